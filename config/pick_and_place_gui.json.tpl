@@ -120,7 +120,31 @@
     "button_bar_height": 60,
     "window_name": "Pick and Place",
     "SAM_checkpoint": "sam_vit_b_01ec64.pth",
+    "detection_workers": 4,
+    "compact_masks": true,
+    "segmentation_cache_size": 4,
+    "scene_change_threshold": 10.0,
+    "segment_fence_only": true,
+    "fence_roi_margin": 50,
+    "segmentation_mode": "auto",
+    "segmentation_backend": "sam",
+    "background_reference": "./captured/empty_workarea.jpg",
+    "background_threshold": 30,
+    "background_min_confidence": 0.5,
     "static_image": "./images/6aee10a5de3b4bdc98a08d0c16145c15.jpg",
+    "command_host": "127.0.0.1",
+    "command_port": 5555,
+    "pipelined": false,
+    "result_display_time": 5,
+    "trace_file": "./traces/gui.jsonl",
+    "metrics_file": "./traces/gui.prom",
+    "profile_segmentation": null,
+    "profile_dir": "./traces",
+    "marker_check_frames": 90,
+    "marker_downscale": 0.75,
+    "marker_average_frames": 5,
+    "marker_drift_threshold": 3.0,
+    "marker_auto_update": false,
     "camera_URL": "http://192.168.1.101:8080/video",
     "static_image_mode": false
 }
\ No newline at end of file
@@ -5,5 +5,14 @@
   "GRIPPER_CLOSE_POS": 300,
   "APPROACH_HEIGHT": 350,
   "HOME_POS": [-0.4, -58.1, -0.7, 15.7, 0.4, 73.8, 0.4],
-  "GRIPPER_TYPE": "vacuum"
+  "GRIPPER_TYPE": "vacuum",
+  "BLEND_RADIUS": 20,
+  "ROTATION_SPEED": 180,
+  "COMMAND_HOST": "127.0.0.1",
+  "COMMAND_PORT": 5555,
+  "FENCE_CLEARANCE": 50,
+  "TRACE_FILE": "./traces/controller.jsonl",
+  "METRICS_FILE": "./traces/controller.prom",
+  "EMULATOR_TIME_SCALE": 1.0,
+  "EMULATOR_VIRTUAL_CLOCK": false
 }
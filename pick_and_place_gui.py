@@ -4,23 +4,51 @@ import time
 import threading
 import os
 import json
+import queue
 
+import utils.camera
 import utils.json_config
-from segmentation.segment import SegmentWithSAM
+from utils.command_channel import send_command, new_job_id, DEFAULT_HOST, DEFAULT_PORT
+from utils.pick_order import order_jobs
+from utils.tracing import Tracer, profiled
+from segmentation.backend import create_backend
+from segmentation.classify import CatalogClassifier
 from segmentation.detect import ObjectDetector
+from segmentation.markers import CalibrationMonitor
+
+# States of a request, posted by the perception thread to the render loop
+IDLE = "idle"
+CAPTURE = "capture"
+SEGMENT = "segment"
+DETECT = "detect"
+SEND = "send"
+WAIT_ROBOT = "wait robot"
 
 
 class PickAndPlaceApp:
     def __init__(self):
         self.config = utils.json_config.load(
             "./config/pick_and_place_gui.json")
-        self.cap = None if self.config['static_image_mode'] else cv2.VideoCapture(
+        self.cap = None if self.config['static_image_mode'] else utils.camera.get_grabber(
             self.config['camera_URL'])
 
         self.current_frame = None
         self.display_frame = None
-        self.processing = False
+        self.display_until = None
+        self.state = IDLE
+        self.events = queue.Queue()
+        # Id of the latest request, the events of earlier ones are dropped.
+        self.request_id = 0
+        self.result_display_time = self.config.get('result_display_time', 5)
         self.selected_object = None
+        self.pipelined = self.config.get('pipelined', False)
+        self.stop_pipeline = False
+        self.wait_job_id = None
+        self.clicked_at = None
+
+        self.tracer = Tracer("gui", self.config.get('trace_file'),
+                             self.config.get('metrics_file'))
+        self.segment_count = 0
 
         self.window_width = self.config['image_width']
         self.window_height = self.config['image_height'] + \
@@ -29,18 +57,57 @@ class PickAndPlaceApp:
 
         self.buttons = self.config['buttons']
 
+        self.static_frame = cv2.imread(
+            self.config['static_image']) if self.cap is None else None
+        self.unavailable_frame = None
+
+        # Reused render buffers, see run()
+        self.canvas = np.zeros(
+            (self.window_height, self.window_width, 3), dtype=np.uint8)
+        self.scaled_size = (int(round(self.window_width * self.config['scale_factor'])),
+                            int(round(self.window_height * self.config['scale_factor'])))
+        self.scaled_canvas = np.zeros(
+            (self.scaled_size[1], self.scaled_size[0], 3), dtype=np.uint8)
+        self.button_bars = {}
+        self.drawn_bar = None
+        self.drawn_source = None
+        self.drawn_prompt = None
+
+        self.robot_status = {"status": "UNKNOWN", "pos": None}
+        self.robot_status_time = 0
+        self.robot_status_interval = 0.2
+
         cv2.namedWindow(self.config['window_name'])
         cv2.setMouseCallback(self.config['window_name'], self.mouse_callback)
 
-        self.segment = SegmentWithSAM(self.config['SAM_checkpoint'])
-        self.detect = ObjectDetector()
+        self.segment = create_backend(self.config)
+        self.detect = ObjectDetector(self.config.get('detection_workers', 1))
         self.objects = utils.json_config.load(
             "./config/objects.json")
         print(self.objects)
+        self.classifier = CatalogClassifier(self.objects)
+        self.classified_masks = None
+        self.classified = []
+
+        # Background check of the camera calibration on every Nth camera frame
+        self.marker_check_frames = self.config.get('marker_check_frames', 90)
+        self.frame_count = 0
+        self.last_frame = None
+        self.calibration = None
+        if self.marker_check_frames:
+            self.calibration = CalibrationMonitor(
+                self.config['workarea'],
+                threshold=self.config.get('marker_drift_threshold', 3.0),
+                auto_update=self.config.get('marker_auto_update', False),
+                on_update=self.save_plane_markers,
+                downscale=self.config.get('marker_downscale', 0.75),
+                average_frames=self.config.get('marker_average_frames', 5))
 
     def mouse_callback(self, event, x, y, flags, param):
         global search_ratio, search_area_ratio, search_area
-        if event == cv2.EVENT_LBUTTONDOWN and not self.processing:
+        if event in (cv2.EVENT_LBUTTONDOWN, cv2.EVENT_RBUTTONDOWN) and not self.processing:
+            # Left click picks one object, right click picks all of the type
+            batch = event == cv2.EVENT_RBUTTONDOWN
             # Check if button is pressed
             x = x / self.config['scale_factor']
             y = y / self.config['scale_factor']
@@ -48,9 +115,16 @@ class PickAndPlaceApp:
                 if (btn["x"] <= x <= btn["x"] + btn["width"] and
                         btn["y"] <= y <= btn["y"] + btn["height"]):
                     self.selected_object = btn["name"]
-                    print(f"Selected object: {self.selected_object}")
-
-                    threading.Thread(target=self.process_frame,
+                    print(f"Selected object: {self.selected_object}" +
+                          (" (all)" if batch else ""))
+
+                    # Applied right away, a second click of the same loop
+                    # iteration must not start another request.
+                    self.request_id += 1
+                    self.post(self.request_id, CAPTURE)
+                    self.handle_events()
+                    self.stop_pipeline = False
+                    threading.Thread(target=self.process_frame, args=(batch, self.request_id),
                                      daemon=True).start()
                     break
 
@@ -89,16 +163,110 @@ class PickAndPlaceApp:
         return frame
 
     def step1_segment(self, frame):
-        self.masks = self.segment.get_masks(frame)
+        self.segment_count += 1
+        profile_path = os.path.join(self.config.get('profile_dir', 'traces'),
+                                    f"segment_{self.segment_count}")
+        with self.tracer.span("segment") as span, \
+                profiled(self.config.get('profile_segmentation'), profile_path):
+            self.masks = self.segment.get_masks(frame)
+            span['masks'] = len(self.masks)
         return self.segment.plot_masks(frame, self.masks)
 
-    def step2_detect(self, frame):
-        return self.detect.detect_object(frame,
-                                         self.masks,
-                                         self.objects[self.selected_object],
-                                         self.config['workarea']['fence'])
+    def classified_objects(self, frame):
+        """Objects of the current masks labeled against the whole catalog, once per segmentation."""
+        masks = self.masks
+        if self.classified_masks is None or len(masks) != len(self.classified_masks) or \
+                any(a is not b for a, b in zip(masks, self.classified_masks)):
+            with self.tracer.span("classify") as span:
+                self.classified = self.detect.classify_objects(frame, masks, self.classifier,
+                                                               self.config['workarea']['fence'])
+                span['objects'] = len(self.classified)
+                span['prefilter_rejected'] = self.detect.prefilter_stats
+            # Keeps the masks alive, so their identity marks the segmentation.
+            self.classified_masks = masks
+            for record in self.classified:
+                if record['classification']['ambiguous']:
+                    print("[CLASSIFY] Ambiguous match at", int(record['cx']), int(record['cy']), ":",
+                          [m['name'] for m in record['classification']['matches']])
+        return self.classified
 
-    def step3_send_to_robot(self, pick_pose):
+    def step2_detect(self, frame):
+        with self.tracer.span("detect", object=self.selected_object):
+            records = self.detect.select_objects(
+                self.classified_objects(frame), self.selected_object, limit=1)
+        if not records:
+            return frame, None
+        return (self.detect.renderer.draw(frame, records[0], self.config['workarea']['fence']),
+                records[0]['pick_pose'])
+
+    def step2_detect_all(self, frame):
+        """Detect every instance, returns the image and the global pick poses in pick order."""
+        with self.tracer.span("detect", object=self.selected_object) as span:
+            records = self.detect.select_objects(
+                self.classified_objects(frame), self.selected_object)
+            span['found'] = len(records)
+        if not records:
+            return frame, []
+
+        with self.tracer.span("transform"):
+            pick_poses = self.detect.convert_all_to_global_coordinates(
+                [r['pick_pose'] for r in records], self.config['workarea'])
+        with self.tracer.span("order", jobs=len(pick_poses)):
+            order = order_jobs([self.make_job(p) for p in pick_poses],
+                               self.robot_start_position())
+
+        image = self.detect.renderer.draw_all(frame,
+                                              [records[i] for i in order],
+                                              self.config['workarea']['fence'],
+                                              labels=list(range(1, len(order) + 1)))
+        return image, [pick_poses[i] for i in order]
+
+    def robot_start_position(self):
+        status = self.robot_status.get("status", "UNKNOWN")
+        pos = self.robot_status.get("pos")
+        if status != "OK" and pos is not None:
+            return pos
+        # The controller starts from this pose after being at home.
+        return self.config.get('robot_start_position', {"x": 204.6, "y": 0})
+
+    def make_job(self, pick_pose):
+        return {
+            "pick_pose": {
+                "x": pick_pose['x'] + self.objects[self.selected_object]['offset']['x'],
+                "y": pick_pose['y'] + self.objects[self.selected_object]['offset']['y'],
+                "z": -25,
+                "roll_degrees": 0,
+                "pitch_degrees": 180,
+                "yaw_degrees": 0  # pick_pose['yaw']
+            },
+            "place_pose": {
+                "x": self.config['place_pose']['x'],
+                "y": self.config['place_pose']['y'],
+                "z": self.config['place_pose']['z'],
+                "roll_degrees": 0,
+                "pitch_degrees": 180,
+                "yaw_degrees": 0,
+            },
+            "fence_polygon": self.fence_polygon(),
+            # Wall time of the request, the controller reports click to grasp
+            "clicked_at": self.clicked_at
+        }
+
+    def fence_polygon(self):
+        """Fence corners in robot coordinates, used by the controller to report when the arm left the view."""
+        workarea = self.config['workarea']
+        fence = workarea['fence']
+        corners = [[fence['xmin'], fence['ymin']], [fence['xmax'], fence['ymin']],
+                   [fence['xmax'], fence['ymax']], [fence['xmin'], fence['ymax']]]
+        x, y, _ = self.detect.get_transform(workarea).convert_array(
+            corners, np.zeros(len(corners)))
+        return [[float(xi), float(yi)] for xi, yi in zip(x, y)]
+
+    def step3_send_to_robot(self, pick_poses, require_idle=True):
+        """
+        Send the picks as one job or a batch. The robot has to be idle unless
+        require_idle is False, then the job is queued behind the running one.
+        """
         path = "robot_status.json"
         if not os.path.exists(path):
             return False
@@ -109,92 +277,210 @@ class PickAndPlaceApp:
         except:
             return False
 
-        if self.robot_status.get("status", "UNKNOWN") == "OK":
-            data = {
-                "pick_pose": {
-                    "x": pick_pose['x'] + self.objects[self.selected_object]['offset']['x'],
-                    "y": pick_pose['y'] + self.objects[self.selected_object]['offset']['y'],
-                    "z": -25,
-                    "roll_degrees": 0,
-                    "pitch_degrees": 180,
-                    "yaw_degrees": 0  # pick_pose['yaw']
-                },
-                "place_pose": {
-                    "x": self.config['place_pose']['x'],
-                    "y": self.config['place_pose']['y'],
-                    "z": self.config['place_pose']['z'],
-                    "roll_degrees": 0,
-                    "pitch_degrees": 180,
-                    "yaw_degrees": 0,
-                }
-            }
-
-            with open("pick_and_place.json", "w") as f:
+        if not require_idle or self.robot_status.get("status", "UNKNOWN") == "OK":
+            jobs = [self.make_job(p) for p in pick_poses]
+            job_id = new_job_id()
+            if len(jobs) == 1:
+                data = dict(type="pick_and_place", job_id=job_id, **jobs[0])
+                self.wait_job_id = job_id
+            else:
+                data = {"type": "batch", "job_id": job_id, "jobs": jobs}
+                self.wait_job_id = f"{job_id}-{len(jobs) - 1}"
+
+            self.last_job_id = send_command(data,
+                                            self.config.get('command_host', DEFAULT_HOST),
+                                            self.config.get('command_port', DEFAULT_PORT))
+            if self.last_job_id is not None:
+                print(f"Sent job {self.last_job_id} to robot:", data)
+                return True
+
+            # Fallback to the pick file, written atomically so the controller
+            # never reads a half-written file.
+            with open("pick_and_place.json.tmp", "w") as f:
                 json.dump(data, f, indent=4)
+            os.replace("pick_and_place.json.tmp", "pick_and_place.json")
 
             print("Created pick_and_place.json:", data)
             return True
 
         return False
 
-    def process_frame(self):
-        self.processing = True
-
-        if self.cap:
-            cap = cv2.VideoCapture(self.config['camera_URL'])
-            ret, frame = cap.read()
-            cap.release()
-            if not ret:
-                self.processing = False
-                return
-        else:
-            frame = cv2.imread(self.config['static_image'])
-
-        original_frame = frame.copy()
-
-        self.display_frame = original_frame.copy()
-
+    def capture_frame(self, after):
+        """Frame grabbed after the given time, None if the camera failed."""
+        with self.tracer.span("capture"):
+            if self.cap:
+                ret, frame = self.cap.read(after=after)
+                return frame if ret else None
+            return self.static_frame.copy()
+
+    def camera_unavailable_frame(self):
+        if self.unavailable_frame is None:
+            self.unavailable_frame = self.add_text_overlay(
+                np.zeros((self.config['image_height'], self.config['image_width'], 3), dtype=np.uint8),
+                "Camera unavailable.", (0, 0, 255))
+        return self.unavailable_frame
+
+    def post(self, request_id, state, frame=None, duration=None):
+        """
+        Post a state change of the request to the render loop, with the frame
+        to display for duration seconds, or until the next change when None.
+        """
+        self.events.put((request_id, state, frame, duration))
+
+    def handle_events(self):
+        """Apply the posted state changes and expire the displayed result, runs in the render loop."""
+        while True:
+            try:
+                request_id, state, frame, duration = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if request_id != self.request_id:
+                # Late events of a finished request, e.g. its final IDLE.
+                continue
+            self.state = state
+            if frame is not None:
+                self.display_frame = frame
+                self.display_until = None if duration is None else time.time() + duration
+            elif state == IDLE and self.display_until is None:
+                self.display_frame = None
+
+        if self.display_until is not None and time.time() >= self.display_until:
+            self.display_frame = None
+            self.display_until = None
+
+    @property
+    def processing(self):
+        return self.state != IDLE
+
+    def perceive(self, original_frame, batch, request_id):
+        """Segment the frame and detect the selected object, returns the result image and the global pick poses."""
         # Step 1: Segmentation
-        self.display_frame = self.add_text_overlay(
-            original_frame.copy(), "Running SAM segmentation...", (0, 255, 255))
+        self.post(request_id, SEGMENT, self.add_text_overlay(
+            original_frame, "Running SAM segmentation...", (0, 255, 255)))
 
         step1_result = self.step1_segment(original_frame)
-        self.display_frame = step1_result.copy()
-        cv2.putText(self.display_frame, "Result from segmentation", (10, 30),
+        cv2.putText(step1_result, "Result from segmentation", (10, 30),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2)
 
         # Step 2: Detection
-        self.display_frame = self.add_text_overlay(
-            self.display_frame.copy(), "Searching for object...", (0, 255, 255))
+        self.post(request_id, DETECT, self.add_text_overlay(
+            step1_result, "Searching for object...", (0, 255, 255)))
 
-        step2_result, pick_pose = self.step2_detect(original_frame)
-        self.display_frame = step2_result.copy()
-        cv2.putText(self.display_frame, "Result from object detection", (10, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2)
+        if batch:
+            step2_result, pick_poses = self.step2_detect_all(original_frame)
+        else:
+            step2_result, pick_pose = self.step2_detect(original_frame)
+            pick_poses = []
+            if pick_pose is not None:
+                with self.tracer.span("transform"):
+                    pick_poses = [self.detect.convert_to_global_coordinates(
+                        pick_pose, self.config['workarea'])]
+        return step2_result, pick_poses
+
+    def sent_frame(self, step2_result, pick_poses, sent):
+        pick_pose = pick_poses[0]
+        frame = step2_result.copy()
+        cv2.putText(frame, "Coordinates sent to robot." if sent else "Robot was not available.",
+                    (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2)
+        cv2.putText(frame, f"x: {int(pick_pose['x'])}, y: {int(pick_pose['y'])}, yaw: {int(pick_pose['yaw'])}" +
+                    (f" (1 of {len(pick_poses)})" if len(pick_poses) > 1 else ""),
+                    (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2)
+        return frame
+
+    def wait_fence_clear(self, job_id, timeout=120.):
+        """Wait until the arm left the fence with the job or the job ended, False on timeout or stop."""
+        deadline = time.time() + timeout
+        while not self.stop_pipeline and time.time() < deadline:
+            self.get_robot_status()
+            status = self.robot_status
+            if status.get("done_job_id") == job_id or (
+                    status.get("job_id") == job_id and status.get("fence_clear")):
+                return True
+            time.sleep(0.05)
+        return False
+
+    def request(self, batch, request_id, pipelined=False):
+        """
+        Capture, segment, detect and send one request.
+
+        The result is displayed for result_display_time and the GUI accepts
+        the next click as soon as the job is handed off to the robot.
+
+        Returns:
+            True when the job was sent to the robot
+        """
+        self.clicked_at = time.time()
+        with self.tracer.span("request", object=self.selected_object, batch=batch,
+                              pipelined=pipelined) as span:
+            # Use a frame grabbed after the click.
+            original_frame = self.capture_frame(self.clicked_at)
+            if original_frame is None:
+                self.post(request_id, IDLE, self.camera_unavailable_frame(), self.result_display_time)
+                return False
+
+            step2_result, pick_poses = self.perceive(original_frame, batch, request_id)
+            span['picks'] = len(pick_poses)
+            if not pick_poses:
+                self.post(request_id, IDLE, self.add_text_overlay(
+                    step2_result, "Object is not detected.", (0, 255, 255)),
+                    self.result_display_time)
+                return False
 
-        if pick_pose is not None:
-            pick_pose = self.detect.convert_to_global_coordinates(
-                pick_pose, self.config['workarea'])
             # Step 3: Pick and place
-            self.display_frame = self.add_text_overlay(
-                step2_result.copy(), "Sending coordinates to robot...", (0, 255, 255))
-            time.sleep(1.5)
-
-            step3_result = self.step3_send_to_robot(pick_pose)
-            self.display_frame = step2_result.copy()
-            cv2.putText(self.display_frame, "Coordinates sent to robot." if step3_result else "Robot was not available.",
-                        (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2)
-            cv2.putText(self.display_frame, f"x: {int(pick_pose['x'])}, y: {int(pick_pose['y'])}, yaw: {int(pick_pose['yaw'])}",
-                        (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2)
-            time.sleep(5)
-        else:
-            self.display_frame = self.add_text_overlay(
-                step2_result.copy(), "Object is not detected.", (0, 255, 255))
-        time.sleep(5)
+            self.post(request_id, SEND, self.add_text_overlay(
+                step2_result, "Sending coordinates to robot...", (0, 255, 255)))
+            with self.tracer.span("send"):
+                sent = self.step3_send_to_robot(pick_poses, require_idle=not pipelined)
+            if sent:
+                span['job_id'] = self.wait_job_id
+
+        keep_picking = sent and self.pipelined and not self.stop_pipeline
+        self.post(request_id, WAIT_ROBOT if keep_picking else IDLE,
+                  self.sent_frame(step2_result, pick_poses, sent), self.result_display_time)
+        return sent
+
+    def run_pipeline(self, batch, request_id):
+        """
+        Overlap the perception of the next pick with the current robot job.
+
+        As soon as the controller reports the last sent job as fence clear,
+        the next frame is captured and segmented while the arm finishes the
+        place, and the next job is queued before the current one ends. Stops
+        when no object is detected, the robot is not reachable or 's' is
+        pressed.
+        """
+        while self.wait_fence_clear(self.wait_job_id):
+            if not self.request(batch, request_id, pipelined=True):
+                break
 
-        self.processing = False
-        self.display_frame = None
-        print(f"Completed for {self.selected_object}")
+    def process_frame(self, batch, request_id):
+        """Perception thread of a click, keeps picking in the pipelined mode."""
+        try:
+            if self.request(batch, request_id) and self.pipelined:
+                self.run_pipeline(batch, request_id)
+        finally:
+            self.post(request_id, IDLE)
+            self.tracer.export_metrics()
+            print(f"Completed for {self.selected_object}")
+
+    def save_plane_markers(self, plane_markers):
+        utils.json_config.save(self.config, "./config/pick_and_place_gui.json")
+
+    def check_calibration(self, frame):
+        """Hand every Nth new camera frame to the calibration monitor while idle."""
+        if self.calibration is None or frame is self.last_frame:
+            return
+        self.last_frame = frame
+        self.frame_count += 1
+        # The perception of a request gets the CPU.
+        if self.frame_count % self.marker_check_frames == 0 and not self.processing:
+            self.calibration.submit(frame)
+
+    def calibration_text(self):
+        if self.calibration is not None and self.calibration.drifted:
+            # Without the value, the button bars are cached per text.
+            return "CALIBRATION DRIFT"
+        return ""
 
     def get_robot_status(self):
         path = "robot_status.json"
@@ -207,46 +493,92 @@ class PickAndPlaceApp:
         except:
             self.robot_status = {"status": "ERROR", "pos": None}
 
-    def draw_robot_status(self, canvas):
-        self.get_robot_status()
+    def robot_status_text(self):
+        now = time.time()
+        if now - self.robot_status_time >= self.robot_status_interval:
+            self.get_robot_status()
+            self.robot_status_time = now
 
         status = self.robot_status.get("status", "UNKNOWN")
+        return "ROBOT IS OK" if status == "OK" else "ROBOT IS BUSY"
 
-        cv2.putText(canvas, "ROBOT IS OK" if status == "OK" else "ROBOT IS BUSY", (2100, 40),
+    def draw_robot_status(self, canvas, text):
+        cv2.putText(canvas, text, (2100, 40),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
 
+    def draw_calibration_alert(self, canvas, text):
+        cv2.putText(canvas, text, (1550, 40),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+
+    def render_button_bar(self):
+        """Copy the cached button bar to the canvas if its state changed."""
+        state = (self.processing, self.robot_status_text(), self.calibration_text())
+        if state == self.drawn_bar:
+            return False
+
+        bar = self.button_bars.get(state)
+        if bar is None:
+            bar = np.zeros(
+                (self.button_height, self.window_width, 3), dtype=np.uint8)
+            self.draw_buttons(bar)
+            self.draw_robot_status(bar, state[1])
+            self.draw_calibration_alert(bar, state[2])
+            self.button_bars[state] = bar
+
+        np.copyto(self.canvas[:self.button_height], bar)
+        self.drawn_bar = state
+        return True
+
+    def render_frame(self, frame):
+        """Copy the frame or the processing result to the canvas if it changed."""
+        display_frame = self.display_frame
+        source = display_frame if display_frame is not None else frame
+        prompt = display_frame is None and not self.processing
+        if source is self.drawn_source and prompt == self.drawn_prompt:
+            return False
+
+        region = self.canvas[self.button_height:]
+        np.copyto(region, source)
+        if prompt:
+            cv2.putText(region, "Choose object", (10, 30),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2)
+
+        self.drawn_source = source
+        self.drawn_prompt = prompt
+        return True
+
     def run(self):
         while True:
             if self.cap:
-                ret, frame = self.cap.read()
-                if not ret:
+                if not self.cap.isOpened():
                     break
+                # Frames older than a second are from a stalled stream.
+                ret, frame = self.cap.read(timeout=0.1, copy=False, max_age=1.0)
             else:
-                frame = cv2.imread(self.config['static_image'])
+                ret, frame = True, self.static_frame
 
-            if self.display_frame is not None:
-                display = self.display_frame.copy()
+            if ret:
+                self.check_calibration(frame)
             else:
-                display = frame.copy()
-                if not self.processing:
-                    cv2.putText(display, "Choose object", (10, 30),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2)
-
-            canvas = np.zeros(
-                (self.window_height, self.window_width, 3), dtype=np.uint8)
-            canvas[self.button_height:, :] = display
-
-            self.draw_buttons(canvas)
-
-            self.draw_robot_status(canvas)
+                frame = self.camera_unavailable_frame()
+            self.handle_events()
+            changed = self.render_frame(frame)
+            changed = self.render_button_bar() or changed
 
-            cv2.imshow(self.config['window_name'], cv2.resize(
-                canvas, None, fx=self.config['scale_factor'], fy=self.config['scale_factor']))
+            if changed:
+                cv2.resize(self.canvas, self.scaled_size,
+                           dst=self.scaled_canvas)
+                cv2.imshow(self.config['window_name'], self.scaled_canvas)
 
             key = cv2.waitKey(1) & 0xFF
             if key == ord('q'):
                 break
+            if key == ord('s'):
+                # Stops the pipelined mode after the running perception.
+                self.stop_pipeline = True
 
+        if self.calibration is not None:
+            self.calibration.stop()
         if self.cap:
             self.cap.release()
         cv2.destroyAllWindows()
@@ -0,0 +1,98 @@
+from abc import ABC, abstractmethod
+
+import cv2
+import numpy as np
+
+from segmentation.masks import mask_region
+
+
+class SegmentationBackend(ABC):
+    """
+    Interface of the segmentation backends used by PickAndPlaceApp.
+
+    get_masks returns SAM compatible mask dicts with at least 'segmentation',
+    'area' and 'bbox', sorted by area in descending order. 'confidence' is the
+    backend's confidence in the last result (1.0 for SAM).
+    """
+
+    confidence = 1.0
+
+    @abstractmethod
+    def get_masks(self, image):
+        pass
+
+    def plot_masks(self, image, masks):
+        annotated = image.copy()
+
+        for mask in masks:
+            m, x0, y0 = mask_region(mask['segmentation'])
+            region = annotated[y0:y0 + m.shape[0], x0:x0 + m.shape[1]]
+
+            color = np.random.randint(0, 255, (3,), dtype=np.uint8)
+
+            region[m] = region[m] * 0.5 + color * 0.5
+
+            contour = cv2.findContours(
+                m.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x0, y0))[0]
+            cv2.drawContours(annotated, contour, -1, (0, 255, 0), 2)
+
+        return annotated
+
+
+class FallbackSegmenter(SegmentationBackend):
+    """Uses the primary backend and falls back when its confidence is low."""
+
+    def __init__(self, primary, create_fallback, min_confidence=0.5):
+        self.primary = primary
+        self.create_fallback = create_fallback
+        self.fallback = None
+        self.min_confidence = min_confidence
+
+    def get_masks(self, image):
+        masks = self.primary.get_masks(image)
+        self.confidence = self.primary.confidence
+        if self.confidence >= self.min_confidence:
+            return masks
+
+        print(f"[SEGMENT] Low confidence {self.confidence:.2f}, falling back.")
+        if self.fallback is None:
+            # The fallback (SAM) is loaded only when it is needed.
+            self.fallback = self.create_fallback()
+        masks = self.fallback.get_masks(image)
+        self.confidence = self.fallback.confidence
+        return masks
+
+
+def create_sam(config):
+    from segmentation.segment import SegmentWithSAM
+
+    return SegmentWithSAM(config['SAM_checkpoint'],
+                          compact=config.get('compact_masks', False),
+                          cache_size=config.get('segmentation_cache_size', 0),
+                          scene_change_threshold=config.get('scene_change_threshold', 10.0),
+                          fence=config['workarea']['fence'] if config.get(
+                              'segment_fence_only', False) else None,
+                          roi_margin=config.get('fence_roi_margin', 50),
+                          mode=config.get('segmentation_mode', 'auto'))
+
+
+def create_backend(config):
+    """Create the segmentation backend selected by 'segmentation_backend' in the GUI config."""
+    backend = config.get('segmentation_backend', 'sam')
+    if backend == 'sam':
+        return create_sam(config)
+
+    if backend == 'background':
+        from segmentation.background import SegmentWithBackground
+
+        primary = SegmentWithBackground(
+            cv2.imread(config['background_reference']),
+            threshold=config.get('background_threshold', 30),
+            fence=config['workarea']['fence'] if config.get(
+                'segment_fence_only', False) else None,
+            roi_margin=config.get('fence_roi_margin', 50),
+            compact=config.get('compact_masks', False))
+        return FallbackSegmenter(primary, lambda: create_sam(config),
+                                 config.get('background_min_confidence', 0.5))
+
+    raise ValueError(f"Unknown segmentation backend: {backend}")
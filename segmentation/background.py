@@ -0,0 +1,89 @@
+import cv2
+import numpy as np
+
+from segmentation.backend import SegmentationBackend
+from segmentation.masks import compact_masks, roi_from_fence
+
+
+class SegmentWithBackground(SegmentationBackend):
+    """
+    Classical segmentation against a captured frame of the empty workarea:
+    background difference, threshold and connected components.
+
+    The confidence drops when the whole scene differs from the reference
+    (lighting change or moved camera), in which case SAM should be used.
+    """
+
+    def __init__(self, reference, threshold=30, min_area=2000, fence=None, roi_margin=50,
+                 max_foreground=0.6, compact=False):
+        if reference is None:
+            raise ValueError("Background reference image is not available.")
+        self.reference = self.preprocess(reference)
+        self.threshold = threshold
+        self.min_area = min_area
+        self.fence = fence
+        self.roi_margin = roi_margin
+        self.max_foreground = max_foreground
+        self.compact = compact
+        self.confidence = 0.0
+
+    def preprocess(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def get_masks(self, image):
+        height, width = image.shape[:2]
+        if self.fence is not None:
+            x0, y0, x1, y1 = roi_from_fence(self.fence, self.roi_margin, image.shape)
+        else:
+            x0, y0, x1, y1 = 0, 0, width, height
+
+        gray = self.preprocess(image)
+        diff = cv2.absdiff(gray[y0:y1, x0:x1], self.reference[y0:y1, x0:x1])
+
+        foreground = np.uint8(diff > self.threshold)
+        kernel = np.ones((5, 5), np.uint8)
+        foreground = cv2.morphologyEx(foreground, cv2.MORPH_OPEN, kernel)
+        foreground = cv2.morphologyEx(foreground, cv2.MORPH_CLOSE, kernel)
+
+        self.confidence = self.frame_confidence(diff, foreground)
+
+        num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(
+            foreground, connectivity=8)
+
+        masks = []
+        for label in range(1, num_labels):
+            area = int(stats[label, cv2.CC_STAT_AREA])
+            if area < self.min_area:
+                continue
+            x = int(stats[label, cv2.CC_STAT_LEFT])
+            y = int(stats[label, cv2.CC_STAT_TOP])
+            w = int(stats[label, cv2.CC_STAT_WIDTH])
+            h = int(stats[label, cv2.CC_STAT_HEIGHT])
+
+            segmentation = np.zeros((height, width), dtype=bool)
+            segmentation[y0 + y:y0 + y + h, x0 + x:x0 + x + w] = \
+                labels[y:y + h, x:x + w] == label
+            contrast = float(np.mean(diff[y:y + h, x:x + w][labels[y:y + h, x:x + w] == label]))
+
+            masks.append({
+                'segmentation': segmentation,
+                'area': area,
+                'bbox': [x0 + x, y0 + y, w, h],
+                'predicted_iou': min(contrast / (2. * self.threshold), 1.),
+                'point_coords': [[x0 + x + w / 2., y0 + y + h / 2.]],
+                'crop_box': [x0, y0, x1 - x0, y1 - y0]
+            })
+
+        masks = sorted(masks, key=lambda m: m['area'], reverse=True)
+        if self.compact:
+            masks = compact_masks(masks)
+        return masks
+
+    def frame_confidence(self, diff, foreground):
+        # A global offset of the background means the reference is not valid.
+        background_shift = float(np.median(diff))
+        confidence = 1. - min(background_shift / self.threshold, 1.)
+        if np.mean(foreground) > self.max_foreground:
+            confidence = 0.
+        return confidence
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+class SceneCache:
+    """
+    Bounded LRU cache of per-frame segmentation results.
+
+    Frames are matched by a cheap scene-change test on downscaled grayscale
+    thumbnails. A frame hits an entry when no thumbnail cell differs by more
+    than the threshold (in gray levels, 0-255), so a single added or removed
+    plate is a change while the camera noise is averaged out.
+    """
+
+    def __init__(self, size=4, threshold=10.0, thumbnail_size=(64, 36)):
+        self.size = size
+        self.threshold = threshold
+        self.thumbnail_size = thumbnail_size
+        self.entries = OrderedDict()
+        self.next_key = 0
+        self.hits = 0
+        self.misses = 0
+
+    def thumbnail(self, image):
+        gray = image if image.ndim == 2 else cv2.cvtColor(
+            image, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, self.thumbnail_size,
+                           interpolation=cv2.INTER_AREA)
+        return small.astype(np.float32)
+
+    def lookup(self, image):
+        """Return (key, value) of the closest unchanged scene, or (None, None)."""
+        thumbnail = self.thumbnail(image)
+        best_key, best_diff = None, None
+        for key, (cached, _) in self.entries.items():
+            diff = float(np.max(np.abs(cached - thumbnail)))
+            if diff <= self.threshold and (best_diff is None or diff < best_diff):
+                best_key, best_diff = key, diff
+
+        if best_key is None:
+            self.misses += 1
+            return None, None
+
+        self.hits += 1
+        self.entries.move_to_end(best_key)
+        return best_key, self.entries[best_key][1]
+
+    def get(self, image):
+        return self.lookup(image)[1]
+
+    def put(self, image, value):
+        key = self.next_key
+        self.next_key += 1
+        self.entries[key] = (self.thumbnail(image), value)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return key
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,38 @@
+import cv2
+import numpy as np
+
+
+def candidate_contours(image, min_area=2000):
+    """External contours of the closed edge blobs with at least min_area pixels, largest first."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+
+    edges = cv2.Canny(gray, 30, 90)
+    kernel = np.ones((5, 5), np.uint8)
+    closed = cv2.morphologyEx(edges, cv2.MORPH_DILATE, kernel, iterations=2)
+    closed = cv2.morphologyEx(closed, cv2.MORPH_CLOSE, kernel, iterations=2)
+
+    contours, _ = cv2.findContours(
+        closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contours = [c for c in contours if cv2.contourArea(c) >= min_area]
+    return sorted(contours, key=cv2.contourArea, reverse=True)
+
+
+def propose_candidates(image, min_area=2000, max_candidates=64, padding=10):
+    """
+    Cheap classical proposals of plate candidates for prompted segmentation.
+
+    Edges are closed into blobs and the bounding boxes of the external
+    contours with at least min_area pixels are returned, largest first, as
+    an N x 4 array of (x0, y0, x1, y1) boxes.
+    """
+    contours = candidate_contours(image, min_area)
+
+    height, width = image.shape[:2]
+    boxes = []
+    for contour in contours[:max_candidates]:
+        x, y, w, h = cv2.boundingRect(contour)
+        boxes.append([max(x - padding, 0), max(y - padding, 0),
+                      min(x + w + padding, width), min(y + h + padding, height)])
+
+    return np.array(boxes, dtype=np.float32).reshape(-1, 4)
@@ -0,0 +1,97 @@
+from bisect import bisect_right
+
+import numpy as np
+
+
+class CatalogClassifier:
+    """
+    Labels region properties against the whole object catalog in one pass.
+
+    Every catalog entry is the box of its tolerances on (area, ratio,
+    area_ratio) and a record matches an entry exactly when
+    ObjectDetector.matches accepts it, the bounds are computed with the
+    same expressions. The score is the largest deviation from the entry in
+    log space, normalized by the tolerance on that side (0 at the entry, 1
+    at the tolerance limit).
+
+    The entries are kept in a sorted interval index on the area, so a query
+    only checks the entries whose area interval contains it instead of the
+    whole catalog.
+    """
+
+    def __init__(self, objects, ambiguity_margin=0.2):
+        self.names = list(objects)
+        self.catalog = list(objects.values())
+        self.ambiguity_margin = ambiguity_margin
+
+        center, lower, upper = [], [], []
+        for params in objects.values():
+            tolerances = (params['area_tolerance'], params['tolerance'], params['tolerance'])
+            values = (params['area'], params['ratio'], params['area_ratio'])
+            center.append(values)
+            # Same bounds as ObjectDetector.matches
+            lower.append([v * ((100. - t) / 100.) for v, t in zip(values, tolerances)])
+            upper.append([v * ((100. + t) / 100.) for v, t in zip(values, tolerances)])
+        self.lower = np.array(lower, dtype=np.float64).reshape(-1, 3)
+        self.upper = np.array(upper, dtype=np.float64).reshape(-1, 3)
+
+        # Log space of the scores, tolerances of 100% or more have no lower limit.
+        self.log_center = np.log(np.array(center, dtype=np.float64).reshape(-1, 3))
+        self.log_lower = np.log(np.maximum(self.lower, self.upper * 1e-12))
+        self.log_upper = np.log(self.upper)
+
+        # Elementary intervals between the sorted area bounds, each with the
+        # entries which cover it, and the entries which cover each bound
+        # itself (entries with a zero area tolerance only cover a bound).
+        area_lower, area_upper = self.lower[:, 0], self.upper[:, 0]
+        self.bounds = np.unique(np.concatenate([area_lower, area_upper])).tolist()
+        self.buckets = [np.flatnonzero((area_lower <= a) & (area_upper >= b))
+                        for a, b in zip(self.bounds[:-1], self.bounds[1:])]
+        self.bound_buckets = [np.flatnonzero((area_lower <= a) & (area_upper >= a))
+                              for a in self.bounds]
+
+    def candidates(self, area):
+        """Indices of the entries whose area interval contains the area."""
+        i = bisect_right(self.bounds, area) - 1
+        if i < 0 or area > self.bounds[-1]:
+            return np.empty(0, dtype=int)
+        if area == self.bounds[i]:
+            return self.bound_buckets[i]
+        return self.buckets[i]
+
+    def classify(self, record):
+        """
+        Ranked matches of a process_mask record.
+
+        Returns:
+            dict with 'label' (best match or None), 'matches' (list of
+            {'name', 'score'} by increasing score) and 'ambiguous' (the two
+            best matches are closer than ambiguity_margin)
+        """
+        features = np.array([record['area'], record['ratio'], record['area_ratio']], dtype=np.float64)
+        index = self.candidates(features[0])
+
+        matches = []
+        if len(index):
+            inside = np.all((features >= self.lower[index]) &
+                            (features <= self.upper[index]), axis=1)
+            index = index[inside]
+
+        if len(index):
+            log_features = np.log(features)
+            center = self.log_center[index]
+            deviation = log_features - center
+            scale = np.where(deviation > 0, self.log_upper[index] - center,
+                             center - self.log_lower[index])
+            # A zero tolerance scores an exact match 0.
+            scores = np.max(np.abs(deviation) / np.maximum(scale, 1e-12), axis=1)
+            matches = sorted(({'name': self.names[i], 'score': float(s)}
+                              for i, s in zip(index, scores)),
+                             key=lambda m: m['score'])
+
+        return {
+            'label': matches[0]['name'] if matches else None,
+            'matches': matches,
+            'ambiguous': len(matches) > 1 and
+            matches[1]['score'] - matches[0]['score'] < self.ambiguity_margin
+        }
@@ -2,24 +2,48 @@ import cv2
 import numpy as np
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-import math
+from concurrent.futures import ThreadPoolExecutor
+
+from segmentation.markers import create_aruco_detector
+from segmentation.render import DetectionRenderer
+from segmentation.transform import WorkareaTransform
+
+
+# Reach of the cleanup chain in process_mask: 5 erodes and 5 dilates with a
+# 9x9 kernel, the 5x5 median blur and the 9x9 close, plus a safety border.
+CROP_PADDING = 5 * 4 + 5 * 4 + 2 + 2 * 4 + 14
+
+# The erosion removes every part of a mask thinner than this (in pixels).
+MIN_MASK_SIZE = 2 * 5 * 4 + 1
+
+# Safety margin of the pre-filter (in pixels) for the growth of the mask in
+# the median blur and the close of the cleanup chain.
+PREFILTER_FENCE_MARGIN = 10
 
 
 class ObjectDetector:
+    def __init__(self, workers=1, crop=True, verbose=False):
+        self.transform = None
+        self.workers = workers
+        self.crop = crop
+        self.verbose = verbose
+        self.prefilter_stats = None
+        # Shared by all calls, the mask cleanup releases the GIL in OpenCV.
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.renderer = DetectionRenderer()
+        self.aruco_detector = None
+
     def find_markers(self, image, markers):
         markers = markers.values()
         marker_tags = [m['tag_id'] for m in markers]
         marker_coordinates = {m['tag_id']: m['global']
                               for m in markers}
         print("mc", marker_coordinates)
-        dictionary = cv2.aruco.getPredefinedDictionary(
-            cv2.aruco.DICT_ARUCO_ORIGINAL)
-        parameters = cv2.aruco.DetectorParameters()
-        detector = cv2.aruco.ArucoDetector(dictionary, parameters)
+        if self.aruco_detector is None:
+            self.aruco_detector = create_aruco_detector()
 
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        all_detected_markers, ids, rejected = detector.detectMarkers(gray)
+        all_detected_markers, ids, rejected = self.aruco_detector.detectMarkers(gray)
 
         plane_markers = {}
         if ids is not None:
@@ -45,119 +69,299 @@ class ObjectDetector:
 
         return plane_markers, all_detected_markers, ids
 
+    def get_transform(self, workarea):
+        if self.transform is None or not self.transform.is_valid_for(workarea):
+            self.transform = WorkareaTransform(workarea)
+        return self.transform
+
     def convert_to_global_coordinates(self, pick_pose, workarea):
-        pose = workarea['pose']
-        plane_markers = workarea['plane_markers'].values()
-        locals = np.array([[m['local']['x'], m['local']['y']]
-                          for m in plane_markers], dtype=np.float32)
-        globals = np.array([[m['global']['x'], m['global']['y']]
-                           for m in plane_markers], dtype=np.float32)
-        H, _ = cv2.findHomography(locals, globals)
-        pix = np.array([[pick_pose['x'], pick_pose['y'], 1]],
-                       dtype=np.float32).T
-        pt = H @ pix
-        pt /= pt[2]
-        coords = (pt[0][0], pt[1][0])
-
-        x0, y0 = pose['x'], pose['y']
-        theta0 = math.radians(pose['yaw'])
-        x_l, y_l = float(coords[0]), float(coords[1])
-        theta_l = math.radians(float(pick_pose['yaw']))
-
-        x_g = x0 + x_l * math.cos(theta0) - y_l * math.sin(theta0)
-        y_g = y0 + x_l * math.sin(theta0) + y_l * math.cos(theta0)
-        theta_g = (theta0 + theta_l + math.pi) % (2 * math.pi) - math.pi
-        theta_g = math.degrees(theta_g)
-
-        return {"x": x_g, "y": y_g, "yaw": theta_g}
+        return self.get_transform(workarea).convert([pick_pose])[0]
 
-    def detect_object(self, image, masks, object_params=None, fence=None, plot=False):
-        index = 0
-        for mask in masks:
-            image1 = image.copy()
-            if plot:
-                print("Mask index: ", index)
-            index = index + 1
+    def convert_all_to_global_coordinates(self, pick_poses, workarea):
+        return self.get_transform(workarea).convert(pick_poses)
+
+    def crop_window(self, mask, shape):
+        """Padded bbox of the mask in frame pixels as (x0, y0, x1, y1), or the whole frame."""
+        height, width = shape[:2]
+        if not self.crop or 'bbox' not in mask:
+            return 0, 0, width, height
+
+        mask_height, mask_width = mask['segmentation'].shape[:2]
+        sx = width / mask_width
+        sy = height / mask_height
+        x, y, w, h = mask['bbox']
+        x0 = max(int(np.floor(x * sx)) - CROP_PADDING, 0)
+        y0 = max(int(np.floor(y * sy)) - CROP_PADDING, 0)
+        x1 = min(int(np.ceil((x + w) * sx)) + CROP_PADDING, width)
+        y1 = min(int(np.ceil((y + h) * sy)) + CROP_PADDING, height)
+        return x0, y0, x1, y1
+
+    def process_mask(self, mask, shape):
+        x0, y0, x1, y1 = self.crop_window(mask, shape)
+
+        binary = mask['segmentation']
+        if binary.shape[:2] != shape[:2]:
+            binary = cv2.resize(binary.astype(np.uint8), (shape[1], shape[0]))
+        binary = np.ascontiguousarray(binary[y0:y1, x0:x1], dtype=np.uint8)
+
+        try:
+            kernel = np.ones((9, 9), np.uint8)
+            cleaned1 = cv2.morphologyEx(
+                binary, cv2.MORPH_ERODE, kernel, iterations=5)
+            cleaned1 = cv2.morphologyEx(
+                cleaned1, cv2.MORPH_DILATE, kernel, iterations=5)
 
-            binary = mask['segmentation'].astype(np.uint8)
-            binary = cv2.resize(binary, (image1.shape[1], image1.shape[0]))
+            num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(
+                cleaned1, connectivity=8)
 
-            try:
-                kernel = np.ones((9, 9), np.uint8)
-                cleaned1 = cv2.morphologyEx(
-                    binary, cv2.MORPH_ERODE, kernel, iterations=5)
-                cleaned1 = cv2.morphologyEx(
-                    cleaned1, cv2.MORPH_DILATE, kernel, iterations=5)
+            largest_component = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
 
-                num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(
-                    cleaned1, connectivity=8)
+            cleaned2 = np.zeros_like(binary)
+            cleaned2[labels == largest_component] = 255
 
-                largest_component = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
+            cleaned3 = cv2.medianBlur(cleaned2, 5)
 
-                cleaned2 = np.zeros_like(binary)
-                cleaned2[labels == largest_component] = 255
+            cleaned_combined = cv2.morphologyEx(
+                cleaned3, cv2.MORPH_CLOSE, kernel, iterations=1)
+            binary = cleaned_combined.copy()
+        except (cv2.error, ValueError):
+            # Nothing left after the erosion (argmax of no components)
+            return None
+        contours, _ = cv2.findContours(
+            binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x0, y0))
+        largest_contour = max(contours, key=cv2.contourArea)
+        rect = cv2.minAreaRect(largest_contour)
+        (cx, cy), (w1, h1), angle = rect
+        w = max(w1, h1)
+        h = min(w1, h1)
+        area = cv2.contourArea(largest_contour)
+        ratio = w/h
+        area_ratio = area / (w * h)
 
-                cleaned3 = cv2.medianBlur(cleaned2, 5)
+        return {
+            'binary': binary,
+            'offset': (x0, y0),
+            'contour': largest_contour,
+            'rect': rect,
+            'cx': cx,
+            'cy': cy,
+            'angle': angle,
+            'w': w,
+            'h': h,
+            'area': area,
+            'ratio': ratio,
+            'area_ratio': area_ratio,
+            'pick_pose': {'x': int(cx), 'y': int(cy), 'yaw': angle}
+        }
 
-                cleaned_combined = cv2.morphologyEx(
-                    cleaned3, cv2.MORPH_CLOSE, kernel, iterations=1)
-                binary = cleaned_combined.copy()
-            except:
+    def process_masks(self, image, masks):
+        """Yield process_mask results in mask order, computed on the thread pool when there is one."""
+        shape = image.shape
+        if self.executor is None:
+            for mask in masks:
+                yield self.process_mask(mask, shape)
+            return
+
+        futures = [self.executor.submit(self.process_mask, mask, shape) for mask in masks]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            # Stop cleaning masks that come after the last used one.
+            for future in futures:
+                future.cancel()
+
+    def _prefilter(self, image, masks, catalog, fence):
+        masks, rejected = self.prefilter_masks(image.shape, masks, catalog, fence)
+        self.prefilter_stats = rejected
+        if self.verbose:
+            print("[DETECT] Pre-filter kept", len(masks),
+                  "masks, rejected:", rejected)
+        return masks
+
+    def prefilter_masks(self, shape, masks, catalog=None, fence=None, min_predicted_iou=None):
+        """
+        Drop masks which cannot match the fence or any catalog entry using only
+        the SAM metadata (bbox, predicted_iou).
+
+        The catalog area is the contour area of the cleaned mask, which
+        includes its holes, so the SAM pixel count is no bound for it. The
+        area rule uses the padded bbox instead, which the contour area can
+        never exceed.
+
+        Returns:
+            (kept masks, number of masks rejected by each rule)
+        """
+        height, width = shape[:2]
+        rejected = {'predicted_iou': 0, 'size': 0, 'fence': 0, 'area': 0}
+
+        min_area = None
+        if catalog:
+            min_area = min(p['area'] * ((100. - p['area_tolerance']) / 100.)
+                           for p in catalog)
+
+        kept = []
+        for mask in masks:
+            if min_predicted_iou is not None and mask.get('predicted_iou', 1.) < min_predicted_iou:
+                rejected['predicted_iou'] += 1
                 continue
-            contours, _ = cv2.findContours(
-                binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            largest_contour = max(contours, key=cv2.contourArea)
-            rect = cv2.minAreaRect(largest_contour)
-            (cx, cy), (w1, h1), angle = rect
-            w = max(w1, h1)
-            h = min(w1, h1)
-            area = cv2.contourArea(largest_contour)
-            ratio = w/h
-            area_ratio = area / (w * h)
-
-            if fence is not None:
-                if cx < fence['xmin'] or cx > fence['xmax'] or cy < fence['ymin'] or cy > fence['ymax']:
+
+            mask_height, mask_width = mask['segmentation'].shape[:2]
+            sx = width / mask_width
+            sy = height / mask_height
+
+            if 'bbox' in mask:
+                x, y, w, h = mask['bbox']
+                x0, y0 = x * sx, y * sy
+                x1, y1 = (x + w) * sx, (y + h) * sy
+
+                if min(x1 - x0, y1 - y0) < MIN_MASK_SIZE:
+                    rejected['size'] += 1
                     continue
 
-                fence_pts = np.array([
-                    [fence['xmin'], fence['ymin']],
-                    [fence['xmin'], fence['ymax']],
-                    [fence['xmax'], fence['ymax']],
-                    [fence['xmax'], fence['ymin']]
-                ], np.int32)
-                cv2.polylines(image1, [fence_pts], True, (0, 0, 255), 2)
+                if fence is not None:
+                    if (x1 < fence['xmin'] - PREFILTER_FENCE_MARGIN or
+                            x0 > fence['xmax'] + PREFILTER_FENCE_MARGIN or
+                            y1 < fence['ymin'] - PREFILTER_FENCE_MARGIN or
+                            y0 > fence['ymax'] + PREFILTER_FENCE_MARGIN):
+                        rejected['fence'] += 1
+                        continue
+
+                if min_area is not None:
+                    max_area = (x1 - x0 + 2 * PREFILTER_FENCE_MARGIN) * \
+                        (y1 - y0 + 2 * PREFILTER_FENCE_MARGIN)
+                    if max_area < min_area:
+                        rejected['area'] += 1
+                        continue
+
+            kept.append(mask)
+
+        return kept, rejected
+
+    def in_fence(self, record, fence):
+        if fence is None:
+            return True
+        return (fence['xmin'] <= record['cx'] <= fence['xmax'] and
+                fence['ymin'] <= record['cy'] <= fence['ymax'])
 
-            box = cv2.boxPoints(rect)
-            box = np.int32(box)
-            cv2.drawContours(image1, [box], 0, (0, 255, 0), 2)
+    def matches(self, record, object_params):
+        area = record['area']
+        ratio = record['ratio']
+        area_ratio = record['area_ratio']
+        if area < object_params['area'] * ((100. - object_params['area_tolerance']) / 100.):
+            return False
+        if area > object_params['area'] * ((100. + object_params['area_tolerance']) / 100.):
+            return False
+        if ratio < object_params['ratio'] * ((100. - object_params['tolerance']) / 100.):
+            return False
+        if ratio > object_params['ratio'] * ((100. + object_params['tolerance']) / 100.):
+            return False
+        if area_ratio < object_params['area_ratio'] * ((100. - object_params['tolerance']) / 100.):
+            return False
+        if area_ratio > object_params['area_ratio'] * ((100. + object_params['tolerance']) / 100.):
+            return False
+        return True
 
-            cv2.circle(image1, (int(cx), int(cy)), radius=7, color=(
-                0, 0, 255), thickness=-1)
+    def find_object(self, image, masks, object_params=None, fence=None, plot=False):
+        """
+        Find the first mask which matches object_params inside the fence.
 
+        Returns:
+            result record of process_mask with the pixel 'pick_pose', or None
+        """
+        records = self.find_objects(image, masks, object_params, fence, plot, limit=1)
+        return records[0] if records else None
+
+    def find_objects(self, image, masks, object_params=None, fence=None, plot=False, limit=None):
+        """
+        Find the masks which match object_params inside the fence, at most
+        limit of them. Masks whose centre lies inside an already found object
+        are duplicates of that object and are skipped.
+
+        Returns:
+            list of result records of process_mask in mask order
+        """
+        if not plot:
+            masks = self._prefilter(image, masks,
+                                    [object_params] if object_params is not None else None, fence)
+
+        records = self.process_masks(image, masks)
+        try:
+            return self._find_objects(image, records, object_params, fence, plot, limit)
+        finally:
+            records.close()
+
+    def _find_objects(self, image, records, object_params, fence, plot, limit):
+        found = []
+        for index, record in enumerate(records):
             if plot:
-                print("(w, h) = ", (w, h), "ratio = ", ratio, "area = ",
-                      area, "area ratio = ", area_ratio)
-                plt.figure(figsize=(40, 10))
-                plt.subplot(121)
-                plt.imshow(binary, 'gray')
-                plt.subplot(122)
-                plt.imshow(cv2.cvtColor(image1, cv2.COLOR_BGR2RGB))
-                plt.show()
-
-            if object_params is not None:
-                if area < object_params['area'] * ((100. - object_params['area_tolerance']) / 100.):
-                    continue
-                if area > object_params['area'] * ((100. + object_params['area_tolerance']) / 100.):
-                    continue
-                if ratio < object_params['ratio'] * ((100. - object_params['tolerance']) / 100.):
-                    continue
-                if ratio > object_params['ratio'] * ((100. + object_params['tolerance']) / 100.):
-                    continue
-                if area_ratio < object_params['area_ratio'] * ((100. - object_params['tolerance']) / 100.):
-                    continue
-                if area_ratio > object_params['area_ratio'] * ((100. + object_params['tolerance']) / 100.):
-                    continue
+                print("Mask index: ", index)
+
+            if record is None:
+                continue
+
+            if not self.in_fence(record, fence):
+                continue
 
-                return image1, {'x': int(cx), 'y': int(cy), 'yaw': angle}
+            if plot:
+                self.renderer.plot(image, record, fence)
 
-        return image, None
+            if object_params is None or not self.matches(record, object_params):
+                continue
+
+            if any(self.contains(other, record) for other in found):
+                continue
+
+            found.append(record)
+            if limit is not None and len(found) >= limit:
+                break
+
+        return found
+
+    def classify_objects(self, image, masks, classifier, fence=None):
+        """
+        Clean every mask once and label it against the whole catalog.
+
+        Returns:
+            list of the process_mask records inside the fence which match any
+            catalog entry, in mask order, with the result of
+            CatalogClassifier.classify in 'classification'
+        """
+        masks = self._prefilter(image, masks, classifier.catalog, fence)
+
+        records = []
+        for record in self.process_masks(image, masks):
+            if record is None or not self.in_fence(record, fence):
+                continue
+            classification = classifier.classify(record)
+            if classification['matches']:
+                record['classification'] = classification
+                records.append(record)
+        return records
+
+    def select_objects(self, records, name, limit=None):
+        """
+        Classified records which match the catalog entry name, at most limit
+        of them and without duplicates like find_objects.
+        """
+        found = []
+        for record in records:
+            if not any(m['name'] == name for m in record['classification']['matches']):
+                continue
+            if any(self.contains(other, record) for other in found):
+                continue
+            found.append(record)
+            if limit is not None and len(found) >= limit:
+                break
+        return found
+
+    def contains(self, record, other):
+        """Whether the centre of other lies inside the rotated rect of record."""
+        box = cv2.boxPoints(record['rect'])
+        return cv2.pointPolygonTest(box, (float(other['cx']), float(other['cy'])), False) >= 0
+
+    def detect_object(self, image, masks, object_params=None, fence=None, plot=False):
+        record = self.find_object(image, masks, object_params, fence, plot)
+        if record is None:
+            return image, None
+        return self.renderer.draw(image, record, fence), record['pick_pose']
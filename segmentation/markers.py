@@ -0,0 +1,253 @@
+import queue
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+
+from segmentation.transform import WorkareaTransform
+
+
+# Half size of the corner refinement window at full resolution
+SUBPIX_WINDOW = (5, 5)
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+
+# Half size of the full resolution window around the last position of a
+# marker which the downscaled detection missed
+FALLBACK_WINDOW = 150
+
+
+def create_aruco_detector():
+    dictionary = cv2.aruco.getPredefinedDictionary(
+        cv2.aruco.DICT_ARUCO_ORIGINAL)
+    parameters = cv2.aruco.DetectorParameters()
+    return cv2.aruco.ArucoDetector(dictionary, parameters)
+
+
+class MarkerTracker:
+    """
+    Tracks the workarea markers over many frames.
+
+    The markers are detected on a downscaled image and their corners are
+    refined at full resolution around each detection only. Markers which
+    the downscaled detection misses are searched at full resolution, in a
+    window around their last position, or in the whole frame (on every
+    average_frames-th frame) when they were not seen yet. The marker
+    centres are averaged
+    over the last average_frames detections of each tag, which removes the
+    corner noise of a single frame.
+    """
+
+    def __init__(self, markers, downscale=0.75, average_frames=5):
+        self.tags = [str(m['tag_id']) for m in markers.values()]
+        self.global_coordinates = {str(m['tag_id']): m['global'] for m in markers.values()}
+        self.downscale = downscale
+        self.detector = create_aruco_detector()
+        self.centers = {tag: deque(maxlen=average_frames) for tag in self.tags}
+        self.average_frames = average_frames
+        self.frames = 0
+
+    def _detect_markers(self, image, scale=1., x0=0, y0=0):
+        """Corners in full resolution frame coordinates of the markers found in the image, by tag."""
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        corners, ids, _ = self.detector.detectMarkers(image)
+        if ids is None:
+            return {}
+        return {str(id_.item()): corner.reshape(4, 2) / scale + (x0, y0)
+                for corner, id_ in zip(corners, ids.flatten())
+                if str(id_.item()) in self.centers}
+
+    def _refine(self, image, points):
+        # Only the padded marker region is converted and refined.
+        height, width = image.shape[:2]
+        x0, y0 = np.maximum(np.floor(points.min(axis=0)).astype(int) - 2 * SUBPIX_WINDOW[0], 0)
+        x1, y1 = np.minimum(np.ceil(points.max(axis=0)).astype(int) + 2 * SUBPIX_WINDOW[0],
+                            (width, height))
+        roi = image[y0:y1, x0:x1]
+        if roi.ndim == 3:
+            roi = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+        refined = np.ascontiguousarray(points - (x0, y0), dtype=np.float32).reshape(-1, 1, 2)
+        cv2.cornerSubPix(roi, refined, SUBPIX_WINDOW, (-1, -1), SUBPIX_CRITERIA)
+        return refined.reshape(4, 2) + (x0, y0)
+
+    def detect(self, image):
+        """Refined corners (4 x 2) of the workarea markers found in the image, by tag."""
+        small = image
+        if self.downscale != 1:
+            small = cv2.resize(image, None, fx=self.downscale, fy=self.downscale,
+                               interpolation=cv2.INTER_AREA)
+        found = self._detect_markers(small, self.downscale)
+
+        height, width = image.shape[:2]
+        unseen = False
+        for tag in self.tags:
+            if tag in found:
+                continue
+            if not self.centers[tag]:
+                unseen = True
+                continue
+            x, y = np.mean(self.centers[tag], axis=0)
+            x0, y0 = max(int(x) - FALLBACK_WINDOW, 0), max(int(y) - FALLBACK_WINDOW, 0)
+            x1, y1 = min(int(x) + FALLBACK_WINDOW, width), min(int(y) + FALLBACK_WINDOW, height)
+            if x0 < x1 and y0 < y1:
+                window = self._detect_markers(image[y0:y1, x0:x1], 1., x0, y0)
+                if tag in window:
+                    found[tag] = window[tag]
+        # A marker which is never visible must not cost a full detection on every frame.
+        if unseen and self.downscale != 1 and self.frames % self.average_frames == 0:
+            found = dict(self._detect_markers(image), **found)
+
+        return {tag: self._refine(image, points) for tag, points in found.items()}
+
+    def update(self, image):
+        """Detect the markers and add their centres to the averages, returns the tags found."""
+        found = self.detect(image)
+        self.frames += 1
+        for tag, corners in found.items():
+            self.centers[tag].append(corners.mean(axis=0))
+        return list(found)
+
+    def reset(self):
+        for centers in self.centers.values():
+            centers.clear()
+
+    def full(self):
+        """True when the averages of every tag hold average_frames detections."""
+        return all(len(centers) == self.average_frames for centers in self.centers.values())
+
+    def missing(self):
+        """Tags without detections in the averages."""
+        return [tag for tag in self.tags if not self.centers[tag]]
+
+    def plane_markers(self, complete=True):
+        """
+        Averaged markers in the plane_markers format. With complete None
+        until every tag was seen, otherwise only the tags seen so far.
+        """
+        if complete and self.missing():
+            return None
+        plane_markers = {}
+        for tag in self.tags:
+            if not self.centers[tag]:
+                continue
+            center = np.mean(self.centers[tag], axis=0)
+            plane_markers[tag] = {
+                "tag_id": tag,
+                "local": {
+                    "x": float(center[0]),
+                    "y": float(center[1])
+                },
+                "global": self.global_coordinates[tag]
+            }
+        return plane_markers
+
+    @staticmethod
+    def reprojection_error(workarea, plane_markers):
+        """
+        Largest distance in pixels between the tracked marker centres and
+        their global coordinates projected through the configured homography.
+        """
+        H_inv = np.linalg.inv(WorkareaTransform(workarea).H)
+        errors = []
+        for marker in plane_markers.values():
+            g = H_inv @ (marker['global']['x'], marker['global']['y'], 1.)
+            errors.append(np.hypot(g[0] / g[2] - marker['local']['x'],
+                                   g[1] / g[2] - marker['local']['y']))
+        return float(max(errors))
+
+
+class CalibrationMonitor:
+    """
+    Checks the camera calibration in the background while the GUI runs.
+
+    submit() hands a frame to the worker thread without blocking and drops
+    it while the previous check is still running. When the averaged marker
+    positions drift from the configured plane_markers by more than
+    threshold pixels, the drift is reported, or with auto_update the
+    averages are restarted and the plane_markers of the workarea are
+    replaced by the new averages, once they are full, and on_update is
+    called.
+    """
+
+    def __init__(self, workarea, threshold=3.0, auto_update=False, on_update=None,
+                 downscale=0.75, average_frames=5):
+        self.workarea = workarea
+        self.threshold = threshold
+        self.auto_update = auto_update
+        self.on_update = on_update
+        self.tracker = MarkerTracker(workarea['plane_markers'], downscale, average_frames)
+        self.error = None
+        self.drifted = False
+        self.checks = 0
+        self.reported_missing = None
+        self.resampling = False
+        self.frames = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, frame):
+        try:
+            self.frames.put_nowait(frame)
+        except queue.Full:
+            pass
+
+    def stop(self):
+        self.frames.put(None)
+
+    def _run(self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            try:
+                self.check(frame)
+            except Exception as e:
+                print("[MARKERS] Check failed:", e)
+
+    def check(self, frame):
+        """Add the markers of the frame to the averages and compare them with the calibration."""
+        self.tracker.update(frame)
+        self.checks += 1
+
+        # Report the tags which were never seen once the averages could be full.
+        missing = self.tracker.missing()
+        if self.checks >= self.tracker.average_frames and \
+                missing != self.reported_missing:
+            if missing:
+                print(f"[MARKERS] Tags {missing} not found in {self.checks} checks, "
+                      "the drift is measured on the other tags")
+            self.reported_missing = missing
+
+        # The new calibration is taken from frames after the drift only.
+        if self.resampling and not self.tracker.full():
+            return
+        resampled, self.resampling = self.resampling, False
+
+        plane_markers = self.tracker.plane_markers(complete=False)
+        if not plane_markers:
+            return
+
+        self.error = self.tracker.reprojection_error(self.workarea, plane_markers)
+        drifted = self.error > self.threshold
+        # Replacing the calibration needs every marker.
+        if drifted and self.auto_update and not missing:
+            if not resampled:
+                # The averages mix the positions before and after the camera moved.
+                print(f"[MARKERS] Calibration drift {self.error:.1f} px, resampling the markers")
+                self.tracker.reset()
+                self.resampling = True
+                return
+            print(f"[MARKERS] Calibration drift {self.error:.1f} px, plane_markers updated")
+            # Replaced as a whole, the detector rebuilds its transform on the next use.
+            self.workarea['plane_markers'] = plane_markers
+            self.error = 0.
+            drifted = False
+            if self.on_update is not None:
+                self.on_update(plane_markers)
+        elif drifted != self.drifted:
+            if drifted:
+                print(f"[MARKERS] Calibration drift {self.error:.1f} px, run update_markers_config.py")
+            else:
+                print(f"[MARKERS] Calibration back within {self.threshold} px")
+        self.drifted = drifted
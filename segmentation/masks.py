@@ -0,0 +1,129 @@
+import numpy as np
+
+
+class CompactMask:
+    """
+    Bit-packed, bbox-cropped binary mask which decodes lazily.
+
+    It can be used in place of the dense boolean 'segmentation' array of the
+    SAM mask dicts: it has a 'shape', supports 2D slicing and converts to a
+    dense array with np.asarray.
+    """
+
+    def __init__(self, packed, shape, box):
+        self.packed = packed
+        self.shape = shape
+        self.box = box  # (x0, y0, x1, y1) of the stored region
+        self.dtype = np.dtype(bool)
+
+    @classmethod
+    def from_dense(cls, segmentation):
+        segmentation = np.asarray(segmentation, dtype=bool)
+        rows = np.flatnonzero(segmentation.any(axis=1))
+        cols = np.flatnonzero(segmentation.any(axis=0))
+        if len(rows) == 0:
+            box = (0, 0, 0, 0)
+        else:
+            box = (int(cols[0]), int(rows[0]),
+                   int(cols[-1]) + 1, int(rows[-1]) + 1)
+        x0, y0, x1, y1 = box
+        packed = np.packbits(segmentation[y0:y1, x0:x1], axis=None)
+        return cls(packed, segmentation.shape, box)
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    def crop(self):
+        """Decode only the stored region, returns (region, x0, y0)."""
+        x0, y0, x1, y1 = self.box
+        count = (x1 - x0) * (y1 - y0)
+        region = np.unpackbits(self.packed, count=count).astype(bool)
+        return region.reshape(y1 - y0, x1 - x0), x0, y0
+
+    def decode(self):
+        dense = np.zeros(self.shape, dtype=bool)
+        region, x0, y0 = self.crop()
+        dense[y0:y0 + region.shape[0], x0:x0 + region.shape[1]] = region
+        return dense
+
+    def __getitem__(self, key):
+        if not (isinstance(key, tuple) and len(key) == 2 and
+                all(isinstance(k, slice) and k.step in (None, 1) for k in key)):
+            return self.decode()[key]
+
+        ys, xs = key
+        qy0, qy1, _ = ys.indices(self.shape[0])
+        qx0, qx1, _ = xs.indices(self.shape[1])
+        out = np.zeros((max(qy1 - qy0, 0), max(qx1 - qx0, 0)), dtype=bool)
+
+        x0, y0, x1, y1 = self.box
+        ix0, iy0 = max(qx0, x0), max(qy0, y0)
+        ix1, iy1 = min(qx1, x1), min(qy1, y1)
+        if ix0 < ix1 and iy0 < iy1:
+            region, _, _ = self.crop()
+            out[iy0 - qy0:iy1 - qy0, ix0 - qx0:ix1 - qx0] = \
+                region[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0]
+        return out
+
+    def shifted(self, dx, dy, shape):
+        """Same mask placed at an offset inside a frame of the given shape."""
+        x0, y0, x1, y1 = self.box
+        return CompactMask(self.packed, shape, (x0 + dx, y0 + dy, x1 + dx, y1 + dy))
+
+    def astype(self, dtype):
+        return self.decode().astype(dtype)
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.decode()
+        return dense if dtype is None else dense.astype(dtype)
+
+
+def compact_masks(masks):
+    """Replace the dense 'segmentation' of SAM mask dicts with CompactMask."""
+    return [dict(m, segmentation=CompactMask.from_dense(m['segmentation']))
+            if not isinstance(m['segmentation'], CompactMask) else m
+            for m in masks]
+
+
+def roi_from_fence(fence, margin, shape):
+    """Fence grown by the margin and clipped to the frame, as (x0, y0, x1, y1)."""
+    height, width = shape[:2]
+    x0 = max(int(fence['xmin']) - margin, 0)
+    y0 = max(int(fence['ymin']) - margin, 0)
+    x1 = min(int(fence['xmax']) + margin, width)
+    y1 = min(int(fence['ymax']) + margin, height)
+    return x0, y0, x1, y1
+
+
+def offset_masks(masks, x0, y0, shape):
+    """Map SAM mask dicts of an image crop at (x0, y0) back to the full frame."""
+    result = []
+    for m in masks:
+        segmentation = m['segmentation']
+        if isinstance(segmentation, CompactMask):
+            segmentation = segmentation.shifted(x0, y0, shape[:2])
+        else:
+            full = np.zeros(shape[:2], dtype=bool)
+            full[y0:y0 + segmentation.shape[0],
+                 x0:x0 + segmentation.shape[1]] = segmentation
+            segmentation = full
+
+        mapped = dict(m, segmentation=segmentation)
+        x, y, w, h = m['bbox']
+        mapped['bbox'] = [x + x0, y + y0, w, h]
+        if 'point_coords' in m:
+            mapped['point_coords'] = [[px + x0, py + y0]
+                                      for px, py in m['point_coords']]
+        if 'crop_box' in m:
+            cx, cy, cw, ch = m['crop_box']
+            mapped['crop_box'] = [cx + x0, cy + y0, cw, ch]
+        result.append(mapped)
+    return result
+
+
+def mask_region(segmentation):
+    """Smallest decoded region of a dense or compact mask, returns (region, x0, y0)."""
+    if isinstance(segmentation, CompactMask):
+        return segmentation.crop()
+    return segmentation, 0, 0
@@ -0,0 +1,50 @@
+import cv2
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+class DetectionRenderer:
+    """Draws the annotations of ObjectDetector result records."""
+
+    def draw(self, image, record, fence=None):
+        return self.draw_all(image, [record], fence)
+
+    def draw_all(self, image, records, fence=None, labels=None):
+        """Draw several records, optionally numbered with labels."""
+        annotated = image.copy()
+
+        if fence is not None:
+            self.draw_fence(annotated, fence)
+
+        for i, record in enumerate(records):
+            box = cv2.boxPoints(record['rect'])
+            box = np.int32(box)
+            cv2.drawContours(annotated, [box], 0, (0, 255, 0), 2)
+
+            center = (int(record['cx']), int(record['cy']))
+            cv2.circle(annotated, center, radius=7, color=(
+                0, 0, 255), thickness=-1)
+            if labels is not None:
+                cv2.putText(annotated, str(labels[i]), (center[0] + 10, center[1] - 10),
+                            cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255), 2)
+
+        return annotated
+
+    def draw_fence(self, image, fence):
+        fence_pts = np.array([
+            [fence['xmin'], fence['ymin']],
+            [fence['xmin'], fence['ymax']],
+            [fence['xmax'], fence['ymax']],
+            [fence['xmax'], fence['ymin']]
+        ], np.int32)
+        cv2.polylines(image, [fence_pts], True, (0, 0, 255), 2)
+
+    def plot(self, image, record, fence=None):
+        print("(w, h) = ", (record['w'], record['h']), "ratio = ", record['ratio'], "area = ",
+              record['area'], "area ratio = ", record['area_ratio'])
+        plt.figure(figsize=(40, 10))
+        plt.subplot(121)
+        plt.imshow(record['binary'], 'gray')
+        plt.subplot(122)
+        plt.imshow(cv2.cvtColor(self.draw(image, record, fence), cv2.COLOR_BGR2RGB))
+        plt.show()
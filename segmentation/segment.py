@@ -3,12 +3,25 @@ import numpy as np
 import torch
 import cv2
 import numpy as np
-from segment_anything import SamAutomaticMaskGenerator, sam_model_registry
+from segment_anything import SamAutomaticMaskGenerator, SamPredictor, sam_model_registry
 
+from segmentation.backend import SegmentationBackend
+from segmentation.cache import SceneCache
+from segmentation.candidates import propose_candidates
+from segmentation.masks import compact_masks, offset_masks, roi_from_fence
 
-class SegmentWithSAM:
-    def __init__(self, checkpoint='sam_vit_b_01ec64.pth', model_type='vit_b'):
+
+class SegmentWithSAM(SegmentationBackend):
+    def __init__(self, checkpoint='sam_vit_b_01ec64.pth', model_type='vit_b', compact=False,
+                 cache_size=0, scene_change_threshold=10.0, fence=None, roi_margin=50,
+                 mode='auto'):
+        self.compact = compact
+        self.mode = mode
+        self.fence = fence
+        self.roi_margin = roi_margin
+        self.cache = SceneCache(cache_size, scene_change_threshold) if cache_size > 0 else None
         device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = device
         self.sam = sam_model_registry[model_type](checkpoint=checkpoint)
         self.sam.to(device=device)
 
@@ -18,25 +31,76 @@ class SegmentWithSAM:
             pred_iou_thresh=0.7,
             stability_score_thresh=0.7
         )
+        self.predictor = SamPredictor(self.sam)
 
     def get_masks(self, image):
-        masks = self.mask_generator.generate(image)
-        sorted_masks = sorted(masks, key=lambda m: np.sum(
-            m['segmentation']), reverse=True)
-        return sorted_masks
+        if self.cache is not None:
+            cached = self.cache.get(image)
+            if cached is not None:
+                print("[SAM] Scene unchanged, using cached masks.")
+                return list(cached['masks'])
+
+        masks = self.generate(image)
+        sorted_masks = sorted(masks, key=lambda m: m['area'], reverse=True)
+        if self.compact:
+            sorted_masks = compact_masks(sorted_masks)
 
-    def plot_masks(self, image, masks):
-        annotated = image.copy()
+        if self.cache is not None:
+            self.cache.put(image, {'masks': sorted_masks})
+        return list(sorted_masks)
 
-        for mask in masks:
-            m = mask['segmentation']
+    def generate(self, image):
+        """Run the mask generator, only inside the fence ROI when a fence is set."""
+        generate = self.generate_prompted if self.mode == 'prompted' else self.mask_generator.generate
+        if self.fence is None:
+            return generate(image)
 
-            color = np.random.randint(0, 255, (3,), dtype=np.uint8)
+        x0, y0, x1, y1 = roi_from_fence(self.fence, self.roi_margin, image.shape)
+        roi = np.ascontiguousarray(image[y0:y1, x0:x1])
+        masks = generate(roi)
+        if self.compact:
+            # Pack the crop sized masks before they are placed in the frame.
+            masks = compact_masks(masks)
+        return offset_masks(masks, x0, y0, image.shape)
 
-            annotated[m] = annotated[m] * 0.5 + color * 0.5
+    def generate_prompted(self, image):
+        """
+        Segment only the plate candidates of the classical pre-detector, with
+        their boxes sent to SamPredictor as one batch of prompts.
 
-            contour = cv2.findContours(
-                m.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
-            cv2.drawContours(annotated, contour, -1, (0, 255, 0), 2)
+        The result has the same format as SamAutomaticMaskGenerator.generate.
+        """
+        boxes = propose_candidates(image)
+        if len(boxes) == 0:
+            return []
+
+        height, width = image.shape[:2]
+        # Same channel order as the images passed to the automatic generator.
+        self.predictor.set_image(image)
+        boxes_torch = torch.as_tensor(boxes, device=self.device)
+        boxes_torch = self.predictor.transform.apply_boxes_torch(
+            boxes_torch, (height, width))
+        masks, iou_predictions, _ = self.predictor.predict_torch(
+            point_coords=None,
+            point_labels=None,
+            boxes=boxes_torch,
+            multimask_output=False
+        )
+        masks = masks[:, 0].cpu().numpy()
+        iou_predictions = iou_predictions[:, 0].cpu().numpy()
+        self.predictor.reset_image()
 
-        return annotated
+        result = []
+        for mask, iou, box in zip(masks, iou_predictions, boxes):
+            area = int(mask.sum())
+            if area == 0:
+                continue
+            result.append({
+                'segmentation': mask,
+                'area': area,
+                'bbox': list(cv2.boundingRect(mask.astype(np.uint8))),
+                'predicted_iou': float(iou),
+                'point_coords': [[float((box[0] + box[2]) / 2), float((box[1] + box[3]) / 2)]],
+                'crop_box': [0, 0, width, height]
+            })
+        return result
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+
+import cv2
+import numpy as np
+
+from segmentation.backend import SegmentationBackend
+from segmentation.candidates import candidate_contours
+from segmentation.masks import CompactMask
+
+
+class StubSegmenter(SegmentationBackend):
+    """
+    Deterministic segmentation backend with cached masks, for benchmarks
+    and tests of the detection stages without the SAM checkpoint.
+
+    Masks are cached per image content in cache_dir. When a frame is not
+    cached, the masks of the segmenter (e.g. SAM on a machine which has the
+    checkpoint) are recorded, or without a segmenter the filled contours of
+    the classical candidates are used.
+    """
+
+    def __init__(self, cache_dir, segmenter=None, compact=False, min_area=2000):
+        self.cache_dir = cache_dir
+        self.segmenter = segmenter
+        self.compact = compact
+        self.min_area = min_area
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def cache_path(self, image):
+        key = hashlib.sha1(np.ascontiguousarray(image)).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get_masks(self, image):
+        path = self.cache_path(image)
+        if os.path.exists(path):
+            return self.load(path)
+
+        if self.segmenter is not None:
+            masks = self.segmenter.get_masks(image)
+        else:
+            masks = self.contour_masks(image)
+        self.save(path, masks)
+        return self.load(path)
+
+    def contour_masks(self, image):
+        height, width = image.shape[:2]
+        masks = []
+        for contour in candidate_contours(image, self.min_area):
+            segmentation = np.zeros((height, width), dtype=np.uint8)
+            cv2.drawContours(segmentation, [contour], -1, 1, -1)
+            x, y, w, h = cv2.boundingRect(contour)
+            masks.append({
+                'segmentation': segmentation.astype(bool),
+                'area': int(np.count_nonzero(segmentation)),
+                'bbox': [x, y, w, h],
+                'predicted_iou': 1.0,
+                'point_coords': [[x + w / 2., y + h / 2.]],
+                'crop_box': [0, 0, width, height]
+            })
+        return sorted(masks, key=lambda m: m['area'], reverse=True)
+
+    def save(self, path, masks):
+        arrays = {}
+        records = []
+        for i, mask in enumerate(masks):
+            segmentation = mask['segmentation']
+            if not isinstance(segmentation, CompactMask):
+                segmentation = CompactMask.from_dense(segmentation)
+            arrays[f"packed_{i}"] = segmentation.packed
+            record = {k: v for k, v in mask.items() if k != 'segmentation'}
+            record['shape'] = list(segmentation.shape)
+            record['box'] = list(segmentation.box)
+            records.append(record)
+
+        arrays['records'] = np.array(json.dumps(records, default=lambda v: v.tolist()))
+        np.savez_compressed(path, **arrays)
+
+    def load(self, path):
+        with np.load(path) as data:
+            records = json.loads(str(data['records']))
+            masks = []
+            for i, record in enumerate(records):
+                segmentation = CompactMask(data[f"packed_{i}"], tuple(record.pop('shape')),
+                                           tuple(record.pop('box')))
+                record['segmentation'] = segmentation if self.compact else segmentation.decode()
+                masks.append(record)
+        return masks
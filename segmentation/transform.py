@@ -0,0 +1,63 @@
+import cv2
+import numpy as np
+
+
+class WorkareaTransform:
+    """Pixel to robot frame transform built once from the workarea calibration."""
+
+    def __init__(self, workarea):
+        self.key = self.calibration_key(workarea)
+
+        plane_markers = workarea['plane_markers'].values()
+        locals = np.array([[m['local']['x'], m['local']['y']]
+                          for m in plane_markers], dtype=np.float32)
+        globals = np.array([[m['global']['x'], m['global']['y']]
+                           for m in plane_markers], dtype=np.float32)
+        H, _ = cv2.findHomography(locals, globals)
+        self.H = H
+
+        pose = workarea['pose']
+        self.x0 = float(pose['x'])
+        self.y0 = float(pose['y'])
+        self.theta0 = np.radians(float(pose['yaw']))
+        self.R = np.array([[np.cos(self.theta0), -np.sin(self.theta0)],
+                           [np.sin(self.theta0), np.cos(self.theta0)]])
+
+    @staticmethod
+    def calibration_key(workarea):
+        pose = workarea['pose']
+        markers = tuple(sorted(
+            (str(tag),
+             float(m['local']['x']), float(m['local']['y']),
+             float(m['global']['x']), float(m['global']['y']))
+            for tag, m in workarea['plane_markers'].items()))
+        return (float(pose['x']), float(pose['y']), float(pose['yaw']), markers)
+
+    def is_valid_for(self, workarea):
+        return self.key == self.calibration_key(workarea)
+
+    def convert_array(self, pixels, yaws):
+        """Convert N pixel points (N x 2) and yaws in degrees to robot x, y, yaw arrays."""
+        pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 2)
+        yaws = np.asarray(yaws, dtype=np.float64).reshape(-1)
+
+        pix = np.hstack([pixels, np.ones((len(pixels), 1))])
+        pt = pix @ self.H.T
+        local = pt[:, :2] / pt[:, 2:3]
+
+        xy = local @ self.R.T
+        x_g = self.x0 + xy[:, 0]
+        y_g = self.y0 + xy[:, 1]
+        theta_g = (self.theta0 + np.radians(yaws) + np.pi) % (2 * np.pi) - np.pi
+
+        return x_g, y_g, np.degrees(theta_g)
+
+    def convert(self, pick_poses):
+        """Convert a list of {'x', 'y', 'yaw'} pixel poses to robot frame poses."""
+        if len(pick_poses) == 0:
+            return []
+        pixels = [[p['x'], p['y']] for p in pick_poses]
+        yaws = [p['yaw'] for p in pick_poses]
+        x_g, y_g, yaw_g = self.convert_array(pixels, yaws)
+        return [{"x": float(x), "y": float(y), "yaw": float(yaw)}
+                for x, y, yaw in zip(x_g, y_g, yaw_g)]
@@ -0,0 +1,89 @@
+import numpy as np
+
+from segmentation.classify import CatalogClassifier
+from segmentation.detect import ObjectDetector
+from test_detect import FENCE, SHAPE, random_masks
+
+
+def random_catalog(count, seed=0):
+    rng = np.random.default_rng(seed)
+    catalog = {}
+    for i in range(count):
+        catalog[f"Plate {i}"] = {
+            'area': float(rng.uniform(5000, 100000)),
+            'ratio': float(rng.uniform(1, 4)),
+            'area_ratio': float(rng.uniform(0.5, 1)),
+            # Zero and over 100% tolerances included
+            'tolerance': int(rng.choice([0, 5, 10, 20, 150])),
+            'area_tolerance': int(rng.choice([0, 5, 10, 20, 150]))
+        }
+    return catalog
+
+
+def boundary_records(catalog, rng):
+    """Records at the centre and exactly at the tolerance bounds of the entries."""
+    records = []
+    for params in catalog.values():
+        def values(key, tolerance):
+            v = params[key]
+            return [v, v * ((100. - tolerance) / 100.), v * ((100. + tolerance) / 100.)]
+        for area in values('area', params['area_tolerance']):
+            for ratio in values('ratio', params['tolerance']):
+                for area_ratio in values('area_ratio', params['tolerance']):
+                    if area > 0 and ratio > 0 and area_ratio > 0:
+                        records.append({'area': area, 'ratio': ratio, 'area_ratio': area_ratio})
+        # Just outside the bounds
+        records.append({'area': np.nextafter(params['area'] * ((100. + params['area_tolerance']) / 100.), np.inf),
+                        'ratio': params['ratio'], 'area_ratio': params['area_ratio']})
+    for _ in range(2000):
+        records.append({'area': float(rng.uniform(1000, 200000)), 'ratio': float(rng.uniform(0.5, 5)),
+                        'area_ratio': float(rng.uniform(0.3, 1.1))})
+    return records
+
+
+def test_classify_matches_detector():
+    catalog = random_catalog(60)
+    classifier = CatalogClassifier(catalog)
+    detect = ObjectDetector()
+    for record in boundary_records(catalog, np.random.default_rng(1)):
+        expected = {name for name, params in catalog.items() if detect.matches(record, params)}
+        classification = classifier.classify(record)
+        assert {m['name'] for m in classification['matches']} == expected
+        scores = [m['score'] for m in classification['matches']]
+        assert scores == sorted(scores)
+        assert all(np.isfinite(scores))
+
+
+def test_zero_tolerance_matches_exact_value():
+    catalog = {"Exact": {'area': 20000., 'ratio': 2., 'area_ratio': 0.8,
+                         'tolerance': 0, 'area_tolerance': 0},
+               "Loose": {'area': 21000., 'ratio': 2., 'area_ratio': 0.8,
+                         'tolerance': 10, 'area_tolerance': 10}}
+    classifier = CatalogClassifier(catalog)
+
+    classification = classifier.classify({'area': 20000., 'ratio': 2., 'area_ratio': 0.8})
+    assert classification['label'] == "Exact"
+    assert classification['matches'][0]['score'] == 0.
+    assert [m['name'] for m in classification['matches']] == ["Exact", "Loose"]
+
+    classification = classifier.classify({'area': 20001., 'ratio': 2., 'area_ratio': 0.8})
+    assert [m['name'] for m in classification['matches']] == ["Loose"]
+
+
+def test_select_objects_matches_find_objects():
+    image = np.zeros(SHAPE, dtype=np.uint8)
+    masks = random_masks(12, seed=3)
+    detect = ObjectDetector()
+    records = [r for r in (detect.process_mask(m, SHAPE) for m in masks) if r is not None]
+    catalog = {f"Plate {i}": {'area': r['area'], 'ratio': r['ratio'], 'area_ratio': r['area_ratio'],
+                              'tolerance': 10, 'area_tolerance': 10}
+               for i, r in enumerate(records)}
+    catalog["Any"] = {'area': 50000, 'ratio': 2, 'area_ratio': 0.8,
+                      'tolerance': 1000, 'area_tolerance': 1000}
+
+    classified = detect.classify_objects(image, masks, CatalogClassifier(catalog), FENCE)
+    for name, params in catalog.items():
+        for limit in (1, None):
+            expected = detect.find_objects(image, masks, params, FENCE, limit=limit)
+            selected = detect.select_objects(classified, name, limit)
+            assert [r['pick_pose'] for r in selected] == [r['pick_pose'] for r in expected]
@@ -0,0 +1,112 @@
+import cv2
+import numpy as np
+import pytest
+
+from segmentation.detect import ObjectDetector
+from segmentation.masks import CompactMask
+
+
+SHAPE = (1080, 1920, 3)
+FENCE = {"xmin": 100, "xmax": 1800, "ymin": 50, "ymax": 1030}
+
+
+def sam_mask(segmentation):
+    """Mask dict with the metadata of the SAM automatic mask generator."""
+    x, y, w, h = cv2.boundingRect(segmentation.astype(np.uint8))
+    return {'segmentation': segmentation, 'area': int(np.count_nonzero(segmentation)),
+            'bbox': [x, y, w, h], 'predicted_iou': 0.95}
+
+
+def random_masks(count, seed=0):
+    rng = np.random.default_rng(seed)
+    masks = []
+    for _ in range(count):
+        segmentation = np.zeros(SHAPE[:2], dtype=np.uint8)
+        center = (float(rng.uniform(100, SHAPE[1] - 100)), float(rng.uniform(100, SHAPE[0] - 100)))
+        size = (float(rng.uniform(60, 400)), float(rng.uniform(60, 300)))
+        box = cv2.boxPoints((center, size, float(rng.uniform(0, 180)))).astype(np.int32)
+        cv2.fillPoly(segmentation, [box], 1)
+        # Noise at the border, removed by the cleanup
+        cv2.circle(segmentation, tuple(int(v) for v in box[0]), int(rng.integers(5, 30)), 1, -1)
+        masks.append(sam_mask(segmentation.astype(bool)))
+    return masks
+
+
+def record_values(record):
+    if record is None:
+        return None
+    return (record['area'], record['ratio'], record['area_ratio'],
+            record['cx'], record['cy'], record['pick_pose'])
+
+
+def baseline_records(masks):
+    """Every mask cleaned on the full frame, like detect_object before the pre-filter."""
+    detect = ObjectDetector(crop=False)
+    return [detect.process_mask(mask, SHAPE) for mask in masks]
+
+
+def baseline_detect(records, object_params, fence):
+    """Pick pose of the first record in the fence which matches, like the original detect_object."""
+    detect = ObjectDetector()
+    for record in records:
+        if record is None or not detect.in_fence(record, fence):
+            continue
+        if detect.matches(record, object_params):
+            return record['pick_pose']
+    return None
+
+
+@pytest.fixture(scope="module")
+def masks():
+    return random_masks(40)
+
+
+def test_crop_matches_full_frame(masks):
+    crop = ObjectDetector(crop=True)
+    full = ObjectDetector(crop=False)
+    for mask in masks:
+        assert record_values(crop.process_mask(mask, SHAPE)) == \
+            record_values(full.process_mask(mask, SHAPE))
+
+
+def test_compact_matches_dense(masks):
+    detect = ObjectDetector()
+    for mask in masks:
+        compact = dict(mask, segmentation=CompactMask.from_dense(mask['segmentation']))
+        assert record_values(detect.process_mask(compact, SHAPE)) == \
+            record_values(detect.process_mask(mask, SHAPE))
+
+
+def plate_with_hole():
+    segmentation = np.zeros(SHAPE[:2], dtype=bool)
+    segmentation[300:601, 500:1101] = True
+    segmentation[360:541, 600:1001] = False
+    return sam_mask(segmentation)
+
+
+def test_prefilter_keeps_masks_with_holes():
+    image = np.zeros(SHAPE, dtype=np.uint8)
+    masks = [plate_with_hole()]
+    records = baseline_records(masks)
+    record = records[0]
+    # The contour area includes the hole, the SAM area does not.
+    assert record['area'] > 1.5 * masks[0]['area']
+    plate = {'area': record['area'], 'ratio': record['ratio'], 'area_ratio': record['area_ratio'],
+             'tolerance': 10, 'area_tolerance': 10}
+
+    detect = ObjectDetector()
+    _, pick_pose = detect.detect_object(image, masks, plate, FENCE)
+    assert pick_pose == baseline_detect(records, plate, FENCE) == {'x': 800, 'y': 450, 'yaw': pick_pose['yaw']}
+    assert detect.prefilter_stats['area'] == 0
+
+
+def test_detect_object_matches_baseline(masks):
+    image = np.zeros(SHAPE, dtype=np.uint8)
+    masks = masks[:10] + [plate_with_hole()]
+    records = baseline_records(masks)
+    for record in records[::2] + records[-1:]:
+        params = {'area': record['area'], 'ratio': record['ratio'],
+                  'area_ratio': record['area_ratio'],
+                  'tolerance': 10, 'area_tolerance': 10}
+        _, pick_pose = ObjectDetector(4).detect_object(image, masks, params, FENCE)
+        assert pick_pose == baseline_detect(records, params, FENCE)
@@ -0,0 +1,180 @@
+"""
+End-to-end benchmark of the perception pipeline over captured frames
+
+Every image in captured/ and images/ is replayed through the segmentation
+backend, ObjectDetector.detect_object for each entry of objects.json and
+convert_to_global_coordinates of the detected pick poses. The whole catalog
+is also labeled in one pass with CatalogClassifier (stage "classify"). The
+per-stage p50/p95/max latency, the peak memory and the mask counts are reported as
+JSON.
+
+Run it from the repository root:
+
+    python utils/benchmark_perception.py --stub --output benchmark.json
+
+With --stub the masks come from a deterministic stub segmenter with a
+mask cache, so the detection and transform stages can be benchmarked
+without the SAM checkpoint. Run it once with --stub --record-sam on a
+machine with SAM to fill the cache with real SAM masks.
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import json_config
+from image_files import list_images
+
+sys.path.append(os.path.abspath("."))
+sys.path.append(os.path.abspath(".."))
+
+from segmentation.backend import create_sam  # noqa: E402
+from segmentation.classify import CatalogClassifier  # noqa: E402
+from segmentation.detect import ObjectDetector  # noqa: E402
+from segmentation.stub import StubSegmenter  # noqa: E402
+
+
+def summarize(samples):
+    """Latency summary [ms] of a list of durations [s]."""
+    if not samples:
+        return {"count": 0}
+    ms = np.array(samples) * 1000.
+    return {"count": len(samples),
+            "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(ms, 95)), 3),
+            "max_ms": round(float(ms.max()), 3)}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024., 1)
+
+
+class Benchmark:
+    def __init__(self, config, objects, segmenter, trace_memory=False):
+        self.config = config
+        self.objects = objects
+        self.segmenter = segmenter
+        self.detect = ObjectDetector(config.get('detection_workers', 1))
+        self.classifier = CatalogClassifier(objects)
+        self.trace_memory = trace_memory
+        self.samples = {}
+        self.memory = {}
+        self.mask_counts = []
+        self.detections = {name: 0 for name in objects}
+
+    def timed(self, stage, function, *args):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        self.samples.setdefault(stage, []).append(elapsed)
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+            self.memory[stage] = max(self.memory.get(stage, 0.), peak)
+        return result
+
+    def run_frame(self, image):
+        workarea = self.config['workarea']
+        masks = self.timed("segment", self.segmenter.get_masks, image)
+        self.mask_counts.append(len(masks))
+
+        for name, object_params in self.objects.items():
+            _, pick_pose = self.timed(f"detect/{name}", self.detect.detect_object,
+                                      image, masks, object_params, workarea['fence'])
+            self.samples.setdefault("detect", []).append(self.samples[f"detect/{name}"][-1])
+            if pick_pose is None:
+                continue
+            self.detections[name] += 1
+            self.timed("transform", self.detect.convert_to_global_coordinates,
+                       pick_pose, workarea)
+
+        # All objects labeled in one pass, as done by the GUI
+        self.timed("classify", self.detect.classify_objects,
+                   image, masks, self.classifier, workarea['fence'])
+
+    def report(self, frames, repeat):
+        report = {
+            "segmenter": type(self.segmenter).__name__,
+            "frames": frames,
+            "repeat": repeat,
+            "stages": {stage: summarize(samples) for stage, samples in self.samples.items()},
+            "masks": {"min": int(min(self.mask_counts, default=0)),
+                      "mean": round(float(np.mean(self.mask_counts)), 2) if self.mask_counts else 0.,
+                      "max": int(max(self.mask_counts, default=0))},
+            "detections": self.detections,
+            "memory": {"peak_rss_mb": peak_rss_mb()},
+        }
+        if self.trace_memory:
+            report["memory"]["python_peak_mb"] = {
+                stage: round(peak, 2) for stage, peak in self.memory.items()}
+        return report
+
+
+def create_segmenter(args, config):
+    # Repeated frames must not be served from the scene cache.
+    config = dict(config, segmentation_cache_size=0)
+    if not args.stub:
+        return create_sam(config)
+    return StubSegmenter(args.mask_cache,
+                         segmenter=create_sam(config) if args.record_sam else None,
+                         compact=config.get('compact_masks', False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("directories", nargs="*", default=["captured", "images"])
+    parser.add_argument("--config", default="./config/pick_and_place_gui.json")
+    parser.add_argument("--objects", default="./config/objects.json")
+    parser.add_argument("--stub", action="store_true",
+                        help="use the stub segmenter with the mask cache instead of SAM")
+    parser.add_argument("--record-sam", action="store_true",
+                        help="record SAM masks of uncached frames to the mask cache")
+    parser.add_argument("--mask-cache", default="./captured/benchmark_masks")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="report the peak Python allocations per stage (slower)")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    config = json_config.load(args.config)
+    objects = json_config.load(args.objects)
+    paths = list_images(args.directories)
+    if not config or not objects or not paths:
+        print("[BENCHMARK] Config, objects or images are missing.")
+        return 1
+
+    benchmark = Benchmark(config, objects, create_segmenter(args, config), args.trace_memory)
+    if args.trace_memory:
+        tracemalloc.start()
+
+    frames = 0
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            print("[BENCHMARK] Cannot read:", path)
+            continue
+        frames += 1
+        for _ in range(args.repeat):
+            benchmark.run_frame(image)
+        print(f"[BENCHMARK] {path}: {benchmark.mask_counts[-1]} masks")
+
+    report = benchmark.report(frames, args.repeat)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print("[BENCHMARK] Saved to", args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Persistent threaded camera grabber
+
+A background thread keeps the stream open, reads every frame and keeps the
+latest ones with timestamps in a ring buffer. Readers get the latest frame
+without reconnecting to the camera. The stream is reopened automatically
+when it is lost; the buffered frames are dropped then, so readers never
+get a stale frame while the camera is away.
+
+Usage:
+    from camera import get_grabber
+
+    camera = get_grabber(camera_url)
+    ret, frame = camera.read()
+"""
+
+import threading
+import time
+from collections import deque
+
+import cv2
+
+
+class CameraGrabber:
+    def __init__(self, url, buffer_size=8, reconnect_delay=1.0):
+        self.url = url
+        self.reconnect_delay = reconnect_delay
+        self.buffer = deque(maxlen=buffer_size)
+        self.condition = threading.Condition()
+        self.running = True
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.url)
+        # Keep the decoder queue short, the ring buffer holds the history.
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    def _run(self):
+        cap = None
+        while self.running:
+            if cap is None or not cap.isOpened():
+                cap = self._open()
+                if not cap.isOpened():
+                    print(f"[CAMERA] Cannot open {self.url}, retrying...")
+                    self._clear()
+                    cap = None
+                    time.sleep(self.reconnect_delay)
+                    continue
+
+            ret, frame = cap.read()
+            if not ret:
+                print(f"[CAMERA] Stream {self.url} lost, reconnecting...")
+                self._clear()
+                cap.release()
+                cap = None
+                time.sleep(self.reconnect_delay)
+                continue
+
+            with self.condition:
+                self.buffer.append((time.time(), frame))
+                self.condition.notify_all()
+
+        if cap is not None:
+            cap.release()
+
+    def _clear(self):
+        with self.condition:
+            self.buffer.clear()
+
+    def read(self, timeout=5.0, after=None, copy=True, max_age=None):
+        """
+        Latest frame, like VideoCapture.read
+
+        Args:
+            timeout: how long to wait for a frame [s]
+            after: only accept a frame grabbed after this time.time() value
+            copy: return a copy; without it the buffered frame is returned
+                  and must not be modified
+            max_age: only accept a frame grabbed at most this many seconds
+                     ago, e.g. when the stream stalls without closing
+
+        Returns:
+            (ret, frame)
+        """
+        if max_age is not None:
+            oldest = time.time() - max_age
+            after = oldest if after is None else max(after, oldest)
+
+        def available():
+            if not self.running:
+                return True
+            return len(self.buffer) > 0 and (after is None or self.buffer[-1][0] > after)
+
+        with self.condition:
+            self.condition.wait_for(available, timeout)
+            if not self.running or not available():
+                return False, None
+            frame = self.buffer[-1][1]
+            return True, frame.copy() if copy else frame
+
+    def frames(self):
+        """Copy of the ring buffer as a list of (timestamp, frame)."""
+        with self.condition:
+            return list(self.buffer)
+
+    def isOpened(self):
+        return self.running
+
+    def release(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+        with _grabbers_lock:
+            if _grabbers.get(self.url) is self:
+                del _grabbers[self.url]
+
+
+_grabbers = {}
+_grabbers_lock = threading.Lock()
+
+
+def get_grabber(url, buffer_size=8):
+    """Shared grabber of the camera, one per URL or device ID."""
+    with _grabbers_lock:
+        grabber = _grabbers.get(url)
+        if grabber is None:
+            grabber = CameraGrabber(url, buffer_size)
+            _grabbers[url] = grabber
+        return grabber
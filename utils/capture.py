@@ -3,6 +3,7 @@ import os
 import uuid
 
 import json_config
+from camera import get_grabber
 
 
 CONFIG = json_config.load("./config/pick_and_place_gui.json")
@@ -12,21 +13,18 @@ camera_url = CONFIG['camera_URL']
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# cap = cv2.VideoCapture(RTSP_URL)
-
-# if not cap.isOpened():
-#     print("Error: Cannot open RTSP stream.")
-#     exit()
+cap = get_grabber(camera_url)
 
 print("Press SPACE to save image, ESC to exit.")
 
 while True:
-    cap = cv2.VideoCapture(camera_url)
-    ret, frame = cap.read()
-    cap.release()
+    ret, frame = cap.read(max_age=1.0)
     if not ret:
-        print("Stream error.")
-        break
+        # The grabber reconnects, only the ESC key ends the capture.
+        print("Waiting for the camera...")
+        if cv2.waitKey(1) == 27:
+            break
+        continue
 
     cv2.imshow("Capture", cv2.resize(
                 frame, None, fx=CONFIG['scale_factor'], fy=CONFIG['scale_factor']))
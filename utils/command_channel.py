@@ -0,0 +1,133 @@
+"""
+Command channel between the GUI and the robot controller
+
+Newline delimited JSON messages over a TCP socket on localhost. The client
+sends one command per connection and the server answers with an
+acknowledgement which carries the job id:
+
+    -> {"type": "pick_and_place", "pick_pose": {...}, "place_pose": {...}}
+    <- {"type": "ack", "job_id": "3f2a..."}
+
+Several jobs can be queued at once with a batch command, the jobs of the
+batch get the ids "<job_id>-<index>":
+
+    -> {"type": "batch", "jobs": [{"pick_pose": ..., "place_pose": ...}, ...]}
+
+Invalid messages, and messages which are not complete within the read
+timeout of the server, are answered with {"type": "error", "error": "..."}.
+"""
+
+import json
+import queue
+import socket
+import threading
+import uuid
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5555
+
+
+def new_job_id():
+    return uuid.uuid4().hex[:12]
+
+
+def _send_message(conn, message):
+    conn.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+
+def _read_message(conn):
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = conn.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    if not data:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+
+class CommandServer:
+    """
+    Accepts commands in a background thread and queues them with their job id.
+
+    A client has read_timeout seconds to send its command, so a stalled
+    connection cannot block the commands of the other clients.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, read_timeout=2.0):
+        self.commands = queue.Queue()
+        self.read_timeout = read_timeout
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen()
+        self.address = self.sock.getsockname()
+        self.running = True
+
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+        print(f"[COMMAND] Listening on {self.address[0]}:{self.address[1]}")
+
+    def _serve(self):
+        while self.running:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                break
+            with conn:
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                conn.settimeout(self.read_timeout)
+                try:
+                    command = _read_message(conn)
+                    if not isinstance(command, dict) or "type" not in command:
+                        _send_message(
+                            conn, {"type": "error", "error": "invalid command"})
+                        continue
+                    job_id = command.get("job_id") or new_job_id()
+                    command["job_id"] = job_id
+                    self.commands.put(command)
+                    _send_message(conn, {"type": "ack", "job_id": job_id})
+                except socket.timeout:
+                    print("[COMMAND] Error: no complete command within", self.read_timeout, "s")
+                    try:
+                        _send_message(conn, {"type": "error", "error": "timeout"})
+                    except OSError:
+                        pass
+                except (OSError, ValueError) as e:
+                    print("[COMMAND] Error:", e)
+
+    def receive(self, timeout=None):
+        """Block until a command arrives, returns None on timeout."""
+        try:
+            return self.commands.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.running = False
+        try:
+            # Wakes up the accept() of the server thread.
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self.thread.join()
+
+
+def send_command(command, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=2.0):
+    """Send a command to the controller, returns the job id or None if it was not accepted."""
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as conn:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            _send_message(conn, command)
+            reply = _read_message(conn)
+    except (OSError, ValueError) as e:
+        print("[COMMAND] Error:", e)
+        return None
+
+    if reply is None or reply.get("type") != "ack":
+        print("[COMMAND] Not accepted:", reply)
+        return None
+    return reply["job_id"]
@@ -0,0 +1,14 @@
+import glob
+import os
+
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+
+
+def list_images(directories):
+    """Sorted paths of the images in the directories."""
+    paths = []
+    for directory in directories:
+        for pattern in IMAGE_PATTERNS:
+            paths += glob.glob(os.path.join(directory, pattern))
+    return sorted(paths)
@@ -0,0 +1,271 @@
+"""
+Learn object profiles for objects.json from labeled captures
+
+Every capture is segmented and the region properties of its masks inside
+the fence (area, ratio, area_ratio) are extracted like in detect_object, on
+a process pool. The feature vectors of each label are clustered and the
+largest cluster becomes the objects.json entry, with its mean properties
+and tolerances from its spread.
+
+Run it from the repository root:
+
+    python utils/learn_objects.py captured --labels labels.json
+
+The labels file maps a capture to one label for all of its masks, or to
+regions given by a point inside the object:
+
+    {
+        "3f2a.jpg": "Plate 6",
+        "9b1c.jpg": [{"label": "Plate 6", "x": 812, "y": 455},
+                     {"label": "Plate 7", "x": 1210, "y": 630}]
+    }
+
+With --label all captures of the directory get the same label. The
+features are cached per capture in --cache, so re-runs only segment new or
+changed captures, or all of them when the fence or the segmentation
+settings changed. Every worker loads its own segmentation backend, so with
+SAM the default is a single worker.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import json_config
+from image_files import list_images
+
+sys.path.append(os.path.abspath("."))
+sys.path.append(os.path.abspath(".."))
+
+from segmentation.backend import create_backend  # noqa: E402
+from segmentation.detect import ObjectDetector  # noqa: E402
+from segmentation.stub import StubSegmenter  # noqa: E402
+
+
+# Relative distance of the (area, ratio, area_ratio) features which links
+# two samples into one cluster.
+CLUSTER_DISTANCE = 0.08
+
+# Tolerances in percent: 3 sigma of the cluster, but at least the minimum
+MIN_TOLERANCE = 5
+TOLERANCE_SIGMAS = 3.
+
+# Settings of the GUI config which change the extracted features
+FEATURE_CONFIG_KEYS = ("segmentation_backend", "SAM_checkpoint", "segmentation_mode",
+                       "segment_fence_only", "fence_roi_margin", "background_reference",
+                       "background_threshold", "background_min_confidence")
+
+worker = {}
+
+
+def init_worker(config, stub_cache):
+    """Load the segmentation backend once per worker process."""
+    if stub_cache:
+        worker['segment'] = StubSegmenter(stub_cache)
+    else:
+        worker['segment'] = create_backend(dict(config, segmentation_cache_size=0))
+    worker['detect'] = ObjectDetector()
+    worker['fence'] = config['workarea']['fence']
+
+
+def extract_features(path):
+    """Region properties of the masks of a capture inside the fence."""
+    image = cv2.imread(path)
+    if image is None:
+        return None
+
+    detect = worker['detect']
+    fence = worker['fence']
+    masks = worker['segment'].get_masks(image)
+    masks, _ = detect.prefilter_masks(image.shape, masks, None, fence)
+
+    features = []
+    for record in detect.process_masks(image, masks):
+        if record is None or not detect.in_fence(record, fence):
+            continue
+        features.append({
+            'area': float(record['area']),
+            'ratio': float(record['ratio']),
+            'area_ratio': float(record['area_ratio']),
+            'cx': float(record['cx']),
+            'cy': float(record['cy']),
+            'box': cv2.boxPoints(record['rect']).tolist()
+        })
+    return features
+
+
+def config_hash(config, stub_cache):
+    settings = {key: config.get(key) for key in FEATURE_CONFIG_KEYS}
+    settings.update(fence=config['workarea']['fence'], stub=stub_cache)
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def file_key(path, settings):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime, settings]
+
+
+def load_cache(path):
+    if path and os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return {}
+
+
+def save_cache(cache, path):
+    with open(path + ".tmp", "w") as f:
+        json.dump(cache, f)
+    os.replace(path + ".tmp", path)
+
+
+def labeled_samples(features, label):
+    """(label, feature) pairs of a capture for a label string or a list of labeled points."""
+    if isinstance(label, str):
+        return [(label, f) for f in features]
+
+    samples = []
+    for region in label:
+        point = (float(region['x']), float(region['y']))
+        for f in features:
+            box = np.array(f['box'], dtype=np.float32)
+            if cv2.pointPolygonTest(box, point, False) >= 0:
+                samples.append((region['label'], f))
+    return samples
+
+
+def feature_vector(f):
+    # Log space, so the distance is relative to the size of the property.
+    return np.log([f['area'], f['ratio'], f['area_ratio']])
+
+
+def largest_cluster(samples):
+    """Single linkage clustering of the features, returns the largest cluster."""
+    vectors = np.array([feature_vector(f) for f in samples])
+    distance = np.abs(vectors[:, None, :] - vectors[None, :, :]).max(axis=2)
+    linked = distance <= math.log1p(CLUSTER_DISTANCE)
+
+    cluster = np.full(len(samples), -1)
+    for start in range(len(samples)):
+        if cluster[start] >= 0:
+            continue
+        cluster[start] = start
+        stack = [start]
+        while stack:
+            i = stack.pop()
+            for j in np.flatnonzero(linked[i] & (cluster < 0)):
+                cluster[j] = start
+                stack.append(j)
+
+    labels, counts = np.unique(cluster, return_counts=True)
+    best = labels[np.argmax(counts)]
+    return [s for s, c in zip(samples, cluster) if c == best]
+
+
+def tolerance(values):
+    values = np.asarray(values)
+    spread = TOLERANCE_SIGMAS * values.std() / values.mean() * 100.
+    return int(max(MIN_TOLERANCE, math.ceil(spread)))
+
+
+def object_profile(samples, previous=None):
+    cluster = largest_cluster(samples)
+    area = [f['area'] for f in cluster]
+    ratio = [f['ratio'] for f in cluster]
+    area_ratio = [f['area_ratio'] for f in cluster]
+    return {
+        "area": round(float(np.mean(area)), 1),
+        "area_ratio": round(float(np.mean(area_ratio)), 2),
+        "ratio": round(float(np.mean(ratio)), 2),
+        # detect_object uses one tolerance for ratio and area_ratio
+        "tolerance": max(tolerance(ratio), tolerance(area_ratio)),
+        "area_tolerance": tolerance(area),
+        "offset": (previous or {}).get('offset', {"x": 0, "y": 0})
+    }, len(cluster)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("directory")
+    parser.add_argument("--labels", help="JSON file with the label per capture or per region")
+    parser.add_argument("--label", help="label of all captures in the directory")
+    parser.add_argument("--config", default="./config/pick_and_place_gui.json")
+    parser.add_argument("--objects", default="./config/objects.json")
+    parser.add_argument("--cache", help="feature cache, default <directory>/object_features.json")
+    parser.add_argument("--workers", type=int,
+                        help="segmentation processes, default 1 with SAM and one per CPU otherwise")
+    parser.add_argument("--stub", help="use the stub segmenter with this mask cache instead of the backend")
+    parser.add_argument("--dry-run", action="store_true", help="print the entries without saving")
+    args = parser.parse_args()
+
+    config = json_config.load(args.config)
+    if not config:
+        return 1
+
+    if args.labels:
+        with open(args.labels, "r") as f:
+            labels = json.load(f)
+    elif args.label:
+        labels = {}
+    else:
+        print("[LEARN] Either --labels or --label is required.")
+        return 1
+
+    paths = list_images([args.directory])
+    labeled = [(p, labels.get(os.path.basename(p), args.label)) for p in paths]
+    labeled = [(p, label) for p, label in labeled if label]
+
+    settings = config_hash(config, args.stub)
+    cache_path = args.cache or os.path.join(args.directory, "object_features.json")
+    cache = load_cache(cache_path)
+    pending = [p for p, _ in labeled
+               if cache.get(os.path.basename(p), {}).get('key') != file_key(p, settings)]
+    print(f"[LEARN] {len(labeled)} labeled captures, {len(pending)} to process")
+
+    workers = args.workers
+    if workers is None:
+        # Each worker holds a SAM model in memory, or a CUDA context.
+        sam = not args.stub and config.get('segmentation_backend', 'sam') == 'sam'
+        workers = 1 if sam else os.cpu_count()
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(pending))),
+                                 initializer=init_worker,
+                                 initargs=(config, args.stub)) as executor:
+            for path, features in zip(pending, executor.map(extract_features, pending)):
+                if features is None:
+                    print("[LEARN] Cannot read:", path)
+                    continue
+                cache[os.path.basename(path)] = {'key': file_key(path, settings), 'features': features}
+                print(f"[LEARN] {path}: {len(features)} regions")
+        save_cache(cache, cache_path)
+
+    samples = {}
+    for path, label in labeled:
+        entry = cache.get(os.path.basename(path))
+        if entry is None:
+            continue
+        for name, feature in labeled_samples(entry['features'], label):
+            samples.setdefault(name, []).append(feature)
+
+    objects = json_config.load(args.objects) if os.path.exists(args.objects) else {}
+    for name, features in sorted(samples.items()):
+        objects[name], clustered = object_profile(features, objects.get(name))
+        print(f"[LEARN] {name}: {objects[name]} from {clustered} of {len(features)} regions")
+
+    if not samples:
+        print("[LEARN] No labeled regions found.")
+        return 1
+    if not args.dry_run:
+        json_config.save(objects, args.objects)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+Motion plan of a pick and place cycle
+
+The cycle is planned as a list of steps. A move step is
+{"name", "pose": [x, y, z, roll, pitch, yaw], "wait"} and an action step is
+{"name", "action"} with the action "grasp" or "release".
+
+Orientation changes are merged into the translation moves at the approach
+height. Moves which are followed by another move are non-blocking and are
+blended into the next one; the arm only stops where the gripper acts.
+"""
+
+import math
+
+
+def move(name, pose, wait=False):
+    return {"name": name, "pose": [float(v) for v in pose], "wait": wait}
+
+
+def action(name, action):
+    return {"name": name, "action": action}
+
+
+def _pose(pose, z=None):
+    return [pose['x'], pose['y'], pose['z'] if z is None else z,
+            pose['roll_degrees'], pose['pitch_degrees'], pose['yaw_degrees']]
+
+
+def plan_pick_and_place(pick_pose, place_pose, approach_height, start_pose=None, final_wait=True):
+    """
+    Plan one pick and place cycle.
+
+    Args:
+        start_pose: cartesian pose [x, y, z, roll, pitch, yaw] to pass through
+                    first (used when coming from the joint home position),
+                    None when the arm is already at the approach height
+        final_wait: block on the last lift, False when the next cycle follows
+    """
+    steps = []
+    if start_pose is not None:
+        steps.append(move("start pose", start_pose))
+
+    steps += [
+        move("pick approach", _pose(pick_pose, approach_height)),
+        move("pick", _pose(pick_pose), wait=True),
+        action("grasp", "grasp"),
+        move("pick lift", _pose(pick_pose, approach_height)),
+        move("place approach", _pose(place_pose, approach_height)),
+        move("place", _pose(place_pose), wait=True),
+        action("release", "release"),
+        move("place lift", _pose(place_pose, approach_height), wait=final_wait),
+    ]
+    return steps
+
+
+def angle_difference(a, b):
+    """Signed shortest rotation [deg] from angle a to angle b."""
+    return (b - a + 180.) % 360. - 180.
+
+
+def _rotation_time(start, end, rotation_speed):
+    return max(abs(angle_difference(a, b))
+               for a, b in zip(start[3:6], end[3:6])) / rotation_speed
+
+
+def segment_speed(start, end, speed, rotation_speed):
+    """Speed of a linear move, limited so the orientation change does not exceed the rotation speed."""
+    distance = math.dist(start[:3], end[:3])
+    rotation = _rotation_time(start, end, rotation_speed)
+    if distance >= 0.1 and rotation > 0:
+        return min(speed, distance / rotation)
+    return speed
+
+
+def corner_speed(start, corner, end, radius, acc):
+    """
+    Highest speed [mm/s] to blend the corner of two moves: the arc tangent
+    to both moves at radius from the corner, with the centripetal
+    acceleration limited to acc.
+    """
+    d_in = [b - a for a, b in zip(start[:3], corner[:3])]
+    d_out = [b - a for a, b in zip(corner[:3], end[:3])]
+    l_in = math.hypot(*d_in)
+    l_out = math.hypot(*d_out)
+    if l_in < 0.1 or l_out < 0.1:
+        return 0.
+    cos_angle = sum(a * b for a, b in zip(d_in, d_out)) / (l_in * l_out)
+    angle = math.acos(max(-1., min(1., cos_angle)))
+    if angle < 1e-6:
+        return math.inf
+    # The blend is shortened to half of the shorter move.
+    radius = min(radius, l_in / 2., l_out / 2.)
+    return math.sqrt(acc * radius / math.tan(angle / 2.))
+
+
+def segment_time(start, end, speed, acc, rotation_speed, v_in=0., v_out=0.):
+    """
+    Trapezoidal profile time of a linear move entered with v_in and left
+    with v_out, or of its orientation change if longer.
+    """
+    distance = math.dist(start[:3], end[:3])
+    rotation = _rotation_time(start, end, rotation_speed)
+    if distance < 0.1:
+        return rotation
+
+    v_max = segment_speed(start, end, speed, rotation_speed)
+    v_in = min(v_in, v_max)
+    v_out = min(v_out, v_max)
+    peak = acc * distance + (v_in * v_in + v_out * v_out) / 2.
+    if peak >= v_max * v_max:
+        cruise = distance - (2. * v_max * v_max - v_in * v_in - v_out * v_out) / (2. * acc)
+        translation = (2. * v_max - v_in - v_out) / acc + cruise / v_max
+    else:
+        translation = (2. * math.sqrt(peak) - v_in - v_out) / acc
+    return max(translation, rotation)
+
+
+def estimate_motion_time(start, steps, speed, acc, rotation_speed, radius=0.):
+    """
+    Planned motion time [s] of the steps from the start pose.
+
+    Moves which do not wait are blended into the following move with the
+    radius: the speed at each corner is limited by the corner speed and by
+    what the arm can reach accelerating from the previous corner and
+    braking to the next stop.
+    """
+    segments = []
+    position = start
+    for i, step in enumerate(steps):
+        if 'pose' not in step:
+            continue
+        following = steps[i + 1] if i + 1 < len(steps) else None
+        blended = radius > 0 and not step['wait'] and following is not None and 'pose' in following
+        segments.append((position, step['pose'], blended))
+        position = step['pose']
+
+    # Speed at the end of each segment
+    v_end = [0.] * len(segments)
+    for i, (a, b, blended) in enumerate(segments[:-1]):
+        if blended:
+            c = segments[i + 1][1]
+            v_end[i] = min(segment_speed(a, b, speed, rotation_speed),
+                           segment_speed(b, c, speed, rotation_speed),
+                           corner_speed(a, b, c, radius, acc))
+    # Reachable from the previous corner and able to stop at the next one
+    for i in range(len(segments)):
+        v_start = v_end[i - 1] if i > 0 else 0.
+        distance = math.dist(segments[i][0][:3], segments[i][1][:3])
+        v_end[i] = min(v_end[i], math.sqrt(v_start * v_start + 2. * acc * distance))
+    for i in range(len(segments) - 2, -1, -1):
+        distance = math.dist(segments[i + 1][0][:3], segments[i + 1][1][:3])
+        v_end[i] = min(v_end[i], math.sqrt(v_end[i + 1] * v_end[i + 1] + 2. * acc * distance))
+
+    total = 0.
+    for i, (a, b, _) in enumerate(segments):
+        total += segment_time(a, b, speed, acc, rotation_speed,
+                              v_end[i - 1] if i > 0 else 0., v_end[i])
+    return total
+
+
+def _segment_distance(p, a, b):
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    length = dx * dx + dy * dy
+    t = 0. if length == 0 else max(0., min(1., ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / length))
+    return math.hypot(p[0] - a[0] - t * dx, p[1] - a[1] - t * dy)
+
+
+def outside_polygon(point, polygon, clearance=0.):
+    """True when the XY point is outside the polygon and at least clearance [mm] away from it."""
+    x, y = point[0], point[1]
+    inside = False
+    for a, b in zip(polygon, polygon[1:] + polygon[:1]):
+        if (a[1] > y) != (b[1] > y) and x < a[0] + (y - a[1]) * (b[0] - a[0]) / (b[1] - a[1]):
+            inside = not inside
+    if inside:
+        return False
+    return all(_segment_distance(point, a, b) >= clearance
+               for a, b in zip(polygon, polygon[1:] + polygon[:1]))
@@ -0,0 +1,65 @@
+"""
+Travel-optimized ordering of pick and place jobs
+
+Every job moves from the previous position (the start position for the
+first job, the previous place pose afterwards) to its pick pose and then to
+its place pose. The order is built with nearest neighbour and improved with
+2-opt segment reversals on the total XY travel distance.
+
+With a single place pose the travel of all jobs after the first one does
+not depend on the order, so only the choice of the first pick matters; with
+different place poses per job the whole order matters.
+"""
+
+import math
+
+
+def _distance(a, b):
+    return math.hypot(a['x'] - b['x'], a['y'] - b['y'])
+
+
+def route_length(jobs, order, start):
+    length = 0.
+    position = start
+    for i in order:
+        length += _distance(position, jobs[i]['pick_pose'])
+        length += _distance(jobs[i]['pick_pose'], jobs[i]['place_pose'])
+        position = jobs[i]['place_pose']
+    return length
+
+
+def order_jobs(jobs, start, max_iterations=100):
+    """
+    Order pick and place jobs for minimal travel.
+
+    Args:
+        jobs: list of dicts with 'pick_pose' and 'place_pose' (x, y in mm)
+        start: current arm position {'x', 'y'}
+
+    Returns:
+        list of job indices in execution order
+    """
+    remaining = list(range(len(jobs)))
+    order = []
+    position = start
+    while remaining:
+        nearest = min(remaining, key=lambda i: _distance(
+            position, jobs[i]['pick_pose']))
+        remaining.remove(nearest)
+        order.append(nearest)
+        position = jobs[nearest]['place_pose']
+
+    best = route_length(jobs, order, start)
+    for _ in range(max_iterations):
+        improved = False
+        for i in range(len(order) - 1):
+            for j in range(i + 1, len(order)):
+                candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                length = route_length(jobs, candidate, start)
+                if length < best - 1e-9:
+                    order, best = candidate, length
+                    improved = True
+        if not improved:
+            break
+
+    return order
@@ -0,0 +1,157 @@
+"""
+Lightweight timing spans and metrics export
+
+    tracer = Tracer("gui", trace_file="traces/gui.jsonl", metrics_file="traces/gui.prom")
+    with tracer.span("segment", frame=3):
+        ...
+    tracer.observe("click_to_grasp", 4.2)
+    tracer.export_metrics()
+
+Every span or observation is appended as one JSON line to the trace file
+and aggregated into a histogram which export_metrics writes in the
+Prometheus text format (e.g. for the node exporter textfile collector).
+Spans opened inside another span of the same thread record it as parent.
+Without files the spans are only aggregated in memory.
+"""
+
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1., 2.5, 5., 10., 30., 60.)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Tracer:
+    def __init__(self, service, trace_file=None, metrics_file=None, clock=time.perf_counter,
+                 buckets=DEFAULT_BUCKETS):
+        self.service = service
+        self.trace_file = trace_file
+        self.metrics_file = metrics_file
+        self.clock = clock
+        self.buckets = buckets
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        for path in (trace_file, metrics_file):
+            if path and os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Time the block, the yielded attributes can be extended inside it."""
+        stack = self.local.__dict__.setdefault('stack', [])
+        parent = stack[-1] if stack else None
+        stack.append(name)
+        wall_start = time.time()
+        start = self.clock()
+        try:
+            yield attributes
+        except Exception as e:
+            attributes['error'] = repr(e)
+            raise
+        finally:
+            duration = self.clock() - start
+            stack.pop()
+            self.record(name, duration, wall_start, parent, attributes)
+
+    def observe(self, name, seconds, **attributes):
+        """Record a duration measured elsewhere, e.g. across processes."""
+        self.record(name, seconds, time.time(), None, attributes)
+
+    def record(self, name, duration, wall_start, parent, attributes):
+        line = {"service": self.service, "span": name, "start": round(wall_start, 6),
+                "duration_s": round(duration, 6)}
+        if parent is not None:
+            line["parent"] = parent
+        line.update(attributes)
+
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.buckets)
+            histogram.observe(duration)
+            if self.trace_file:
+                with open(self.trace_file, "a") as f:
+                    f.write(json.dumps(line, default=str) + "\n")
+
+    def metrics_text(self):
+        metric = "pick_and_place_span_seconds"
+        lines = [f"# HELP {metric} Duration of the instrumented stages.",
+                 f"# TYPE {metric} histogram"]
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                labels = f'service="{self.service}",span="{name}"'
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f'{metric}_bucket{{{labels},le="{bound:g}"}} {count}')
+                lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum{{{labels}}} {histogram.sum:.6f}")
+                lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def export_metrics(self):
+        """Write the metrics file atomically so a scraper never reads a partial file."""
+        if not self.metrics_file:
+            return
+        text = self.metrics_text()
+        with open(self.metrics_file + ".tmp", "w") as f:
+            f.write(text)
+        os.replace(self.metrics_file + ".tmp", self.metrics_file)
+
+
+@contextmanager
+def profiled(kind, path):
+    """
+    Profile the block when kind is set.
+
+    'cprofile' dumps cProfile stats to <path>.prof, 'torch' exports a
+    Chrome trace of the torch profiler to <path>.json.
+    """
+    if not kind:
+        yield
+        return
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if kind == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path + ".prof")
+        print("[PROFILE] Saved to", path + ".prof")
+    elif kind == 'torch':
+        import torch
+        from torch.profiler import profile, ProfilerActivity
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        with profile(activities=activities, record_shapes=True) as profiler:
+            yield
+        profiler.export_chrome_trace(path + ".json")
+        print("[PROFILE] Saved to", path + ".json")
+    else:
+        raise ValueError(f"Unknown profiler: {kind}")
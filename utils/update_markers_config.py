@@ -2,6 +2,7 @@
 import os
 import json_config
 import cv2
+from camera import get_grabber
 import sys
 
 sys.path.append(os.path.abspath("."))
@@ -18,14 +19,16 @@ frame = None
 if config['static_image_mode']:
     frame = cv2.imread(config['static_image'])
 else:
-    cap = cv2.VideoCapture(config['camera_URL'])
-    ret, frame = cap.read()
+    cap = get_grabber(config['camera_URL'])
+    ret, frame = cap.read(max_age=1.0)
     cap.release()
 
     if not ret:
         frame = None
 
-if frame is not None:
+if frame is None:
+    print("[MARKERS] No camera frame, the config is not changed.")
+else:
     markers = config['workarea']['plane_markers']
     detect = ObjectDetector()
     plane_markers, _, _ = detect.find_markers(frame, markers)
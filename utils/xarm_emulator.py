@@ -8,14 +8,29 @@ Usage:
     robot.motion_enable(enable=True)
     robot.set_mode(0)
     robot.set_state(state=0)
+
+Motion:
+    Moves are queued and executed in order like on the xArm controller,
+    with a trapezoidal velocity profile from speed and mvacc, blending of
+    moves with a radius and a limited rotation speed of the orientation.
+
+Time:
+    Motions and gripper actions advance a simulated clock, see clock().
+    With time_scale the emulator runs faster (> 1) or slower (< 1) than
+    real time. With virtual_clock motions and gripper actions complete
+    instantly and only the simulated clock advances, so many pick cycles
+    run in seconds while the cycle times are still reported.
 """
 
 import time
 import math
 import threading
 import random
+from collections import deque
 from typing import Tuple, List, Optional
 
+from utils.motion_plan import angle_difference, corner_speed
+
 
 class XArmEmulator:
     CODE_SUCCESS = 0
@@ -27,10 +42,20 @@ class XArmEmulator:
     STATE_PAUSED = 3
     STATE_ERROR = 4
 
-    def __init__(self, ip: str = "127.0.0.1", is_radian: bool = False):
+    # Time step [s] of the simulated motion
+    TIME_STEP = 0.01
+
+    def __init__(self, ip: str = "127.0.0.1", is_radian: bool = False,
+                 time_scale: float = 1.0, virtual_clock: bool = False,
+                 rotation_speed: float = 180.0):
         self.ip = ip
         self.is_radian = is_radian
 
+        self.time_scale = time_scale
+        self.virtual_clock = virtual_clock
+        self._sim_time = 0.0
+        self._clock_lock = threading.Lock()
+
         self._connected = True
         self._motion_enabled = False
         self._mode = 0  # 0=position mode, 1=servo mode, etc.
@@ -45,7 +70,7 @@ class XArmEmulator:
         self._workspace_limits = {
             'x': (-700, 700),
             'y': (-700, 700),
-            'z': (0, 700),
+            'z': (-400, 700),
             'roll': (-360, 360),
             'pitch': (-360, 360),
             'yaw': (-360, 360)
@@ -53,7 +78,14 @@ class XArmEmulator:
 
         self._max_speed = 1000
         self._current_speed = 100
-
+        self._current_acc = 2000
+        self._rotation_speed = rotation_speed  # [deg/s]
+        self._velocity = 0.0
+
+        # Moves are queued like on the controller and executed in order
+        self._commands = deque()
+        self._motion_condition = threading.Condition()
+        self._busy = False
         self._movement_thread = None
         self._stop_movement = False
         self._movement_lock = threading.Lock()
@@ -61,7 +93,20 @@ class XArmEmulator:
         self._total_distance = 0.0
         self._total_movements = 0
 
-        print(f"XArmAPI Emulator Running...")
+        mode = "virtual clock" if virtual_clock else f"time scale {time_scale:g}"
+        print(f"XArmAPI Emulator Running ({mode})...")
+
+    def clock(self) -> float:
+        """Simulated time [s] since the start of the emulator"""
+        with self._clock_lock:
+            return self._sim_time
+
+    def _sleep(self, seconds: float):
+        """Advance the simulated clock, sleeping the scaled real time unless the clock is virtual"""
+        with self._clock_lock:
+            self._sim_time += seconds
+        if not self.virtual_clock:
+            time.sleep(seconds / self.time_scale)
 
     def _format_position(self, pos: List[float]) -> str:
         return f"X:{pos[0]:.1f} Y:{pos[1]:.1f} Z:{pos[2]:.1f} R:{pos[3]:.1f} P:{pos[4]:.1f} Y:{pos[5]:.1f}"
@@ -73,9 +118,12 @@ class XArmEmulator:
 
     def disconnect(self) -> int:
         self._stop_movement = True
+        with self._motion_condition:
+            self._commands.clear()
+            self._connected = False
+            self._motion_condition.notify_all()
         if self._movement_thread and self._movement_thread.is_alive():
             self._movement_thread.join()
-        self._connected = False
         print("XArmAPI Emulator: connection closed.")
         return self.CODE_SUCCESS
 
@@ -138,25 +186,29 @@ class XArmEmulator:
     def set_position(self, x: Optional[float] = None, y: Optional[float] = None,
                      z: Optional[float] = None, roll: Optional[float] = None,
                      pitch: Optional[float] = None, yaw: Optional[float] = None,
+                     radius: Optional[float] = None,
                      speed: Optional[float] = None, mvacc: Optional[float] = None,
                      mvtime: Optional[float] = None, relative: bool = False,
                      wait: bool = False, timeout: Optional[float] = None,
                      **kwargs) -> int:
         """
-        Move to position
+        Queue a linear move to the position
 
         Args:
             x, y, z: [mm]
             roll, pitch, yaw: [degrees]
+            radius: blend radius [mm], the move is blended into the next
+                    queued move without stopping when set
             speed: [mm/s]
-            wait: wait for movement
-            relative: relative position
+            mvacc: [mm/s^2]
+            wait: wait until all queued moves are done
+            relative: relative to the last commanded position
         """
         if not self._motion_enabled:
             print("XArmAPI Emulator: error motors are disabled.")
             return self.CODE_ERROR
 
-        target = self._current_position.copy()
+        target = self._target_position.copy()
 
         if x is not None:
             target[0] = (target[0] + x) if relative else x
@@ -178,16 +230,21 @@ class XArmEmulator:
 
         if speed is not None:
             self._current_speed = min(speed, self._max_speed)
+        if mvacc is not None:
+            self._current_acc = mvacc
 
+        distance = self._calculate_distance(self._target_position, target)
         self._target_position = target
 
-        distance = self._calculate_distance(self._current_position, target)
-
         print(f"XArmAPI Emulator: move to {self._format_position(target)}")
         print(
-            f"XArmAPI Emulator: distance {distance:.1f} mm, speed: {self._current_speed:.0f} mm/s")
+            f"XArmAPI Emulator: distance {distance:.1f} mm, speed: {self._current_speed:.0f} mm/s, "
+            f"acc: {self._current_acc:.0f} mm/s^2")
 
-        self._start_movement(wait)
+        self._start_movement({"target": target,
+                              "speed": self._current_speed,
+                              "acc": self._current_acc,
+                              "radius": radius or 0}, wait)
 
         return self.CODE_SUCCESS
 
@@ -206,93 +263,200 @@ class XArmEmulator:
             (pos2[2] - pos1[2])**2
         )
 
-    def _start_movement(self, wait: bool = False):
-        self._stop_movement = True
-        if self._movement_thread and self._movement_thread.is_alive():
-            self._movement_thread.join()
-
-        self._stop_movement = False
-        self._state = self.STATE_MOVING
+    def _start_movement(self, command: dict, wait: bool = False):
+        with self._motion_condition:
+            self._commands.append(command)
+            self._state = self.STATE_MOVING
+            self._motion_condition.notify_all()
 
-        self._movement_thread = threading.Thread(
-            target=self._simulate_movement)
-        self._movement_thread.daemon = True
-        self._movement_thread.start()
+        if not self.virtual_clock and not (self._movement_thread and self._movement_thread.is_alive()):
+            self._movement_thread = threading.Thread(target=self._motion_loop)
+            self._movement_thread.daemon = True
+            self._movement_thread.start()
 
         if wait:
-            self._movement_thread.join()
+            self._wait_for_motion()
+
+    def _wait_for_motion(self):
+        """Block until all queued moves are done"""
+        if self.virtual_clock:
+            # The queue is executed on the simulated clock by the caller.
+            while self._next_command(block=False):
+                pass
+            return
+
+        with self._motion_condition:
+            self._motion_condition.wait_for(
+                lambda: not self._commands and not self._busy)
+
+    def _next_command(self, block: bool) -> bool:
+        """Execute the next queued move, False when the queue is empty (and the emulator closed when blocking)"""
+        with self._motion_condition:
+            if not self._commands:
+                self._busy = False
+                if self._state == self.STATE_MOVING:
+                    self._state = self.STATE_READY
+                self._motion_condition.notify_all()
+                if not block:
+                    return False
+                self._motion_condition.wait_for(
+                    lambda: self._commands or not self._connected)
+                if not self._commands:
+                    return False
+            command = self._commands.popleft()
+            self._busy = True
+
+        self._simulate_movement(command)
+        return True
 
-    def _simulate_movement(self):
+    def _motion_loop(self):
+        while self._connected:
+            self._next_command(block=True)
+
+    def _exit_speed(self, start: List[float], command: dict) -> float:
+        """
+        Speed [mm/s] at the end of the move: blended into the queued moves
+        within the corner speeds, and slow enough to stop at the end of the
+        last blended move.
+        """
+        with self._motion_condition:
+            queued = list(self._commands)
+        chain = [(start, command)]
+        for following in queued:
+            if chain[-1][1]['radius'] <= 0:
+                break
+            chain.append((chain[-1][1]['target'], following))
+
+        v_end = 0.0
+        for (start_in, move_in), (corner, move_out) in zip(chain[-2::-1], chain[:0:-1]):
+            distance = self._calculate_distance(corner, move_out['target'])
+            reachable = math.sqrt(v_end * v_end + 2 * move_out['acc'] * distance)
+            v_end = min(reachable, move_in['speed'], move_out['speed'],
+                        corner_speed(start_in, corner, move_out['target'],
+                                     move_in['radius'], move_in['acc']))
+        return v_end
+
+    def _simulate_movement(self, command: dict):
+        """
+        Execute one move with a trapezoidal velocity profile.
+
+        The TCP accelerates with mvacc up to the speed and brakes in time to
+        stop at the target. A move with a blend radius leaves with the speed
+        of the queued moves instead of stopping, limited by the speed at
+        which the corners can be blended within the radius. The speed is
+        limited so the orientation change does not exceed the rotation speed.
+        """
         start_pos = self._current_position.copy()
-        target_pos = self._target_position.copy()
+        target_pos = command['target']
 
         distance = self._calculate_distance(start_pos, target_pos)
-        if distance < 0.1:
-            self._state = self.STATE_READY
+        rotation = [angle_difference(a, b)
+                    for a, b in zip(start_pos[3:], target_pos[3:])]
+        rotation_time = max(abs(r) for r in rotation) / self._rotation_speed
+        if distance < 0.1 and rotation_time < self.TIME_STEP:
+            self._velocity = 0.0
             return
 
-        move_time = distance / self._current_speed
-        steps = int(move_time * 50)
-        steps = max(steps, 10)
-
-        delay = move_time / steps
+        acc = command['acc']
+        v_max = command['speed']
+        if distance >= 0.1 and rotation_time > 0:
+            v_max = min(v_max, distance / rotation_time)
+        v = self._velocity
+        s = 0.0
+        elapsed = 0.0
+        dt = self.TIME_STEP
+        blended = False
+
+        while not self._stop_movement:
+            step = dt
+            if distance >= 0.1:
+                v_out = min(v_max, self._exit_speed(start_pos, command))
+                blended = v_out > 0.0
+
+                # Accelerate (or slow down to v_max) unless the target could
+                # not be reached with v_out after this step.
+                v_next = min(v + acc * dt, v_max) if v <= v_max else max(v - acc * dt, v_max)
+                if v_next * v_next - v_out * v_out > 2 * acc * (distance - s - (v + v_next) / 2 * dt):
+                    v_next = max(v - acc * dt, v_out)
+
+                v_mean = (v + v_next) / 2
+                if v_mean * dt >= distance - s or v_next <= 0.0:
+                    # Last step, shortened to end at the target
+                    step = (distance - s) / v_mean if v_mean > 0 else dt
+                    s = distance
+                else:
+                    s += v_mean * dt
+                v = v_next
+                t = min(s / distance, 1.0)
+            else:
+                elapsed += dt
+                t = min(elapsed / rotation_time, 1.0)
 
-        for step in range(steps + 1):
-            if self._stop_movement:
-                print("XArmAPI Emulator: movement stopped.")
-                break
-
-            t = step / steps
             with self._movement_lock:
-                for i in range(6):
+                for i in range(3):
                     self._current_position[i] = start_pos[i] + \
                         (target_pos[i] - start_pos[i]) * t
+                for i in range(3):
+                    self._current_position[3 + i] = start_pos[3 + i] + rotation[i] * t
 
-            time.sleep(delay)
+            self._sleep(step)
+            if t >= 1.0:
+                break
+        else:
+            print("XArmAPI Emulator: movement stopped.")
+            self._velocity = 0.0
+            return
 
-        with self._movement_lock:
-            for i in range(3):
-                self._current_position[i] += random.uniform(-0.5, 0.5)
+        self._velocity = v if blended else 0.0
+        if not blended:
+            with self._movement_lock:
+                for i in range(3):
+                    self._current_position[i] += random.uniform(-0.5, 0.5)
 
         self._total_distance += distance
         self._total_movements += 1
 
-        self._state = self.STATE_READY
         print(
             f"XArmAPI Emulator: position reached {self._format_position(self._current_position)}.")
 
     def set_servo_angle(self, servo_id: Optional[int] = None, angle: Optional[float] = None,
                         speed: Optional[float] = None, wait: bool = False, **kwargs) -> int:
         print(f"XArmAPI Emulator: set servo={servo_id}, angle={angle}°")
+        self._wait_for_motion()
         if wait:
-            time.sleep(0.5)
+            self._sleep(0.5)
         return self.CODE_SUCCESS
 
     def set_gripper_position(self, pos: float, wait: bool = False, speed: Optional[float] = None,
                              **kwargs) -> int:
         print(f"XArmAPI Emulator: set gripper position {pos}")
         if wait:
-            time.sleep(0.5)
+            self._sleep(0.5)
         return self.CODE_SUCCESS
 
     def set_vacuum_gripper(self, on, wait=False, timeout=3, delay_sec=None, sync=True, hardware_version=1) -> int:
         print(f"XArmAPI Emulator: set vacuum gripper to {on}")
+        if sync:
+            self._wait_for_motion()
         if wait:
-            time.sleep(0.5)
+            self._sleep(0.5)
         return self.CODE_SUCCESS
 
-    def get_vacuum_gripper(self, hardware_version=1) -> int:
+    def get_vacuum_gripper(self, hardware_version=1) -> Tuple[int, int]:
         print(f"XArmAPI Emulator: get vacuum gripper")
-        time.sleep(0.5)
-        return 1
+        self._sleep(0.5)
+        return (self.CODE_SUCCESS, 1)
 
     def emergency_stop(self) -> int:
         self._stop_movement = True
+        with self._motion_condition:
+            self._commands.clear()
         self._state = self.STATE_ERROR
         print("XArmAPI Emulator: emergency stop.")
         return self.CODE_SUCCESS
 
     def clean_error(self) -> int:
+        self._stop_movement = False
         self._error_code = 0
         self._state = self.STATE_READY
         print("XArmAPI Emulator: errors are cleaned.")
@@ -310,7 +474,8 @@ class XArmEmulator:
             'total_movements': self._total_movements,
             'current_position': self._current_position.copy(),
             'state': self._state,
-            'motion_enabled': self._motion_enabled
+            'motion_enabled': self._motion_enabled,
+            'simulated_time': self.clock()
         }
 
     def reset_statistics(self):
@@ -1,8 +1,13 @@
 import time
 import json
 import os
+import threading
+from collections import deque
 
 import utils.json_config
+import utils.motion_plan as motion_plan
+from utils.command_channel import CommandServer, DEFAULT_HOST, DEFAULT_PORT, new_job_id
+from utils.tracing import Tracer
 
 CONFIG = utils.json_config.load("config/xarm_pick_and_place.json")
 
@@ -21,9 +26,25 @@ GRIPPER_TYPE = CONFIG['GRIPPER_TYPE']
 PICK_FILE = 'pick_and_place.json'
 STATUS_FILE = 'robot_status.json'
 SLEEP_TIME = 1
+START_POSE = [204.6, 0, 346.1, 179.9, 0, 0]
+BLEND_RADIUS = CONFIG.get('BLEND_RADIUS', 20)
+ROTATION_SPEED = CONFIG.get('ROTATION_SPEED', 180)
+COMMAND_HOST = CONFIG.get('COMMAND_HOST', DEFAULT_HOST)
+COMMAND_PORT = CONFIG.get('COMMAND_PORT', DEFAULT_PORT)
+FENCE_CLEARANCE = CONFIG.get('FENCE_CLEARANCE', 50)
+FENCE_POLL_INTERVAL = 0.05
 
 
-arm = XArmAPI(ROBOT_IP)
+if CONFIG['EMULATE_ROBOT']:
+    arm = XArmAPI(ROBOT_IP, time_scale=CONFIG.get('EMULATOR_TIME_SCALE', 1.0),
+                  virtual_clock=CONFIG.get('EMULATOR_VIRTUAL_CLOCK', False),
+                  rotation_speed=ROTATION_SPEED)
+    # Cycle times are measured on the simulated clock of the emulator.
+    clock = arm.clock
+else:
+    arm = XArmAPI(ROBOT_IP)
+    clock = time.time
+tracer = Tracer("controller", CONFIG.get('TRACE_FILE'), CONFIG.get('METRICS_FILE'), clock=clock)
 arm.connect()
 arm.motion_enable(True)
 arm.set_mode(0)
@@ -36,64 +57,101 @@ else:
     arm.set_gripper_enable(True)
 
 
-def write_status(status, pos=None):
-    """Write the status to JSON"""
-    data = {"status": status, "pos": pos if pos else None}
-    with open(STATUS_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+jobs = deque()
+robot_status = {"status": "BUSY", "pos": None, "queued": 0,
+                "job_id": None, "fence_clear": False, "done_job_id": None}
+status_lock = threading.Lock()
+# Moves left unawaited at the end of the last job and the commanded pose
+# they start from, they execute in the time of the chained job.
+pending_motion = {"start": None, "steps": []}
+
+
+def write_status(status=None, pos=None, **job):
+    """
+    Write the status to JSON, the job fields are kept from the last call.
+
+    The file is replaced atomically since the GUI polls it while the
+    controller and the fence monitor write it.
+    """
+    with status_lock:
+        if status is not None:
+            robot_status.update(status=status, pos=pos if pos else None)
+        robot_status.update(job, queued=len(jobs))
+        with open(STATUS_FILE + '.tmp', 'w') as f:
+            json.dump(robot_status, f, indent=2)
+        os.replace(STATUS_FILE + '.tmp', STATUS_FILE)
+
+
+class FenceMonitor:
+    """
+    Reports when the arm has left the camera view of the fence after a pick.
+
+    The GUI sends the fence as a polygon in robot coordinates with the job.
+    Once the object is grasped the TCP position is polled and the job is
+    marked fence_clear in the status as soon as it is FENCE_CLEARANCE
+    outside the polygon, so the GUI can capture and segment the next frame
+    while the arm finishes the place. Without a polygon the job is marked
+    clear when the arm reaches the place pose.
+    """
+
+    def __init__(self, job):
+        self.job_id = job['job_id']
+        self.polygon = job.get('fence_polygon')
+        self.grasped = threading.Event()
+        self.stopped = threading.Event()
+        self.cleared = False
+        self.thread = None
+        if self.polygon:
+            self.thread = threading.Thread(target=self._watch, daemon=True)
+            self.thread.start()
+
+    def _watch(self):
+        while not self.stopped.wait(FENCE_POLL_INTERVAL):
+            if not self.grasped.is_set():
+                continue
+            code, position = arm.get_position()
+            if code == 0 and motion_plan.outside_polygon(position, self.polygon, FENCE_CLEARANCE):
+                self.clear()
+                return
+
+    def clear(self):
+        if not self.cleared:
+            self.cleared = True
+            print(f"Job {self.job_id}: fence clear")
+            write_status(fence_clear=True)
 
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
 
-def move_to_xyzrpy(x, y, z, roll=180, pitch=0, yaw=0, wait=True, speed=100, mvacc=100, status='OK'):
-    """Move to XYZ RPY"""
-    arm.set_position(x, y, z, roll, pitch, yaw, wait=wait,
+
+def move_to_xyzrpy(x, y, z, roll=180, pitch=0, yaw=0, wait=True, speed=100, mvacc=100, status='OK', radius=None):
+    """Move to XYZ RPY, blended into the next move when radius is set"""
+    arm.set_position(x, y, z, roll, pitch, yaw, radius=radius, wait=wait,
                      speed=9*speed, mvacc=5*mvacc)
     write_status(status, {"x": x, "y": y, "z": z})
 
 
-def pick_and_place(pick_and_place):
-    try:
-        pick_pose = pick_and_place['pick_pose']
-        place_pose = pick_and_place_data['place_pose']
-
-        x, y, z, roll, pitch, yaw = [204.6, 0, 346.1, 179.9, 0, 0]
-
-        print("Open gripper")
-        if GRIPPER_TYPE == 'vacuum':
-            arm.set_vacuum_gripper(on=False, wait=True,
-                                   timeout=3, hardware_version=2)
-        else:
-            arm.set_gripper_position(GRIPPER_OPEN_POS, wait=True)
-
-        print("Move to home:", x, y, z, roll, pitch, yaw)
-        move_to_xyzrpy(x, y, z, roll, pitch, yaw, status='BUSY')
-
-        z = APPROACH_HEIGHT
-        print("Move to approach height:", x, y, z, roll, pitch, yaw)
-        move_to_xyzrpy(x, y, z, roll, pitch, yaw, status='BUSY')
-
-        roll = pick_pose['roll_degrees']
-        pitch = pick_pose['pitch_degrees']
-        yaw = pick_pose['yaw_degrees']
-        print("Move to pick orientation:", x, y, z, roll, pitch, yaw)
-        move_to_xyzrpy(x, y, z, roll, pitch, yaw, status='BUSY')
-
-        x = pick_pose['x']
-        y = pick_pose['y']
-        print("Move to pick XY position:", x, y, z, roll, pitch, yaw)
-        move_to_xyzrpy(x, y, z, roll, pitch, yaw, status='BUSY')
-
-        z = pick_pose['z']
-        print("Move to pick Z position:", x, y, z, roll, pitch, yaw)
-        move_to_xyzrpy(x, y, z, roll, pitch, yaw, status='BUSY')
-
-        print("Close gripper")
-        if GRIPPER_TYPE == 'vacuum':
-            arm.set_vacuum_gripper(
-                on=True, wait=True, timeout=3, hardware_version=2)
-            _, grasped = arm.get_vacuum_gripper(hardware_version=2)
-            retries = 3
-            while grasped != 1 and retries > 0:
-                retries = retries - 1
+def open_gripper():
+    if GRIPPER_TYPE == 'vacuum':
+        arm.set_vacuum_gripper(on=False, wait=True,
+                               timeout=3, hardware_version=2)
+    else:
+        arm.set_gripper_position(GRIPPER_OPEN_POS, wait=True)
+
+
+def grasp(pose):
+    """Close the gripper at the pick pose, retrying lower with the vacuum gripper"""
+    x, y, z, roll, pitch, yaw = pose
+    if GRIPPER_TYPE == 'vacuum':
+        arm.set_vacuum_gripper(
+            on=True, wait=True, timeout=3, hardware_version=2)
+        _, grasped = arm.get_vacuum_gripper(hardware_version=2)
+        retries = 3
+        while grasped != 1 and retries > 0:
+            retries = retries - 1
+            with tracer.span("vacuum_retry", z=z - 5):
                 arm.set_vacuum_gripper(
                     on=False, wait=True, timeout=5, hardware_version=2)
                 z = z - 5
@@ -103,72 +161,162 @@ def pick_and_place(pick_and_place):
                     on=True, wait=True, timeout=5, hardware_version=2)
                 _, grasped = arm.get_vacuum_gripper(hardware_version=2)
                 print("grasped", grasped)
-        else:
-            arm.set_gripper_position(GRIPPER_OPEN_POS, wait=True)
-
-        z = APPROACH_HEIGHT
-        print("Move to approach height:", x, y, z, roll, pitch, yaw)
-        move_to_xyzrpy(x, y, z, roll, pitch, yaw, status='BUSY')
-
-        roll = place_pose['roll_degrees']
-        pitch = place_pose['pitch_degrees']
-        yaw = place_pose['yaw_degrees']
-        print("Move to place orientation:", x, y, z, roll, pitch, yaw)
-        move_to_xyzrpy(x, y, z, roll, pitch, yaw, status='BUSY')
-
-        x = place_pose['x']
-        y = place_pose['y']
-        print("Move to place XY position:", x, y, z, roll, pitch, yaw)
-        move_to_xyzrpy(x, y, z, roll, pitch, yaw, status='BUSY')
-
-        z = place_pose['z']
-        print("Move to place Z position:", x, y, z, roll, pitch, yaw)
-        move_to_xyzrpy(x, y, z, roll, pitch, yaw, status='BUSY')
-
-        print("Open gripper")
-        if GRIPPER_TYPE == 'vacuum':
-            arm.set_vacuum_gripper(on=False, wait=True,
-                                   timeout=3, hardware_version=2)
-        else:
-            arm.set_gripper_position(GRIPPER_OPEN_POS, wait=True)
-
-        z = APPROACH_HEIGHT
-        print("Move to approach height:", x, y, z, roll, pitch, yaw)
-        move_to_xyzrpy(x, y, z, roll, pitch, yaw, status='BUSY')
+    else:
+        arm.set_gripper_position(GRIPPER_CLOSE_POS, wait=True)
+
+
+def pick_and_place(pick_and_place, chained=False, final_wait=True):
+    """
+    Execute one pick and place job.
+
+    When chained, the arm is at the approach height above the previous place
+    pose with an open gripper and goes directly to the next pick. Without
+    final_wait the last lift is not awaited, so the next job blends into it.
+
+    Returns:
+        True when the job completed without errors
+    """
+    job_id = pick_and_place['job_id']
+    write_status(job_id=job_id, fence_clear=False)
+    monitor = FenceMonitor(pick_and_place)
+    try:
+        with tracer.span("job", job_id=job_id, chained=chained) as span:
+            start_time = clock()
+            # Gripper actions are not part of the planned motion time.
+            action_time = 0.
+            if chained:
+                start = pending_motion['start']
+                pending = pending_motion['steps']
+                start_pose = None
+            else:
+                print("Open gripper")
+                with tracer.span("open_gripper", job_id=job_id):
+                    open_gripper()
+                action_time = clock() - start_time
+                # The arm stands still after the awaited home move.
+                _, position = arm.get_position()
+                start = list(position[:6])
+                pending = []
+                start_pose = START_POSE
+
+            steps = motion_plan.plan_pick_and_place(pick_and_place['pick_pose'],
+                                                    pick_and_place['place_pose'],
+                                                    APPROACH_HEIGHT,
+                                                    start_pose=start_pose,
+                                                    final_wait=final_wait)
+            # The unawaited moves at the end execute in the time of the next
+            # job, the planned motion covers the same moves as the clock.
+            awaited = len(steps)
+            while awaited > 0 and not steps[awaited - 1].get('wait', True):
+                awaited -= 1
+            planned = motion_plan.estimate_motion_time(
+                start, pending + steps[:awaited], 9*100, 5*100, ROTATION_SPEED, BLEND_RADIUS)
+
+            for step in steps:
+                if step.get('action') == 'grasp':
+                    print("Close gripper")
+                    action_start = clock()
+                    with tracer.span("grasp", job_id=job_id):
+                        grasp(last_pose)
+                    action_time += clock() - action_start
+                    monitor.grasped.set()
+                    if pick_and_place.get('clicked_at'):
+                        # Wall time, the GUI runs on the same machine.
+                        tracer.observe("click_to_grasp", time.time() - pick_and_place['clicked_at'],
+                                       job_id=job_id)
+                elif step.get('action') == 'release':
+                    print("Open gripper")
+                    action_start = clock()
+                    with tracer.span("release", job_id=job_id):
+                        open_gripper()
+                    action_time += clock() - action_start
+                else:
+                    last_pose = step['pose']
+                    print(f"Move to {step['name']}:", *last_pose)
+                    # Blended moves return immediately, their motion time is
+                    # accounted to the next waited move.
+                    with tracer.span("move_" + step['name'].replace(' ', '_'), job_id=job_id, wait=step['wait']):
+                        move_to_xyzrpy(*last_pose, wait=step['wait'], status='BUSY',
+                                       radius=None if step['wait'] else BLEND_RADIUS)
+                    if step['name'] == 'place':
+                        monitor.clear()
 
+            executed = clock() - start_time
+            pending_motion['start'] = [step['pose'] for step in steps[:awaited] if 'pose' in step][-1]
+            pending_motion['steps'] = steps[awaited:]
+            span.update(planned_s=round(planned, 3), motion_s=round(executed - action_time, 3))
+            print(f"[MOTION] Job {job_id}: planned motion {planned:.2f} s, "
+                  f"executed motion {executed - action_time:.2f} s, cycle {executed:.2f} s")
+        return True
     except Exception as e:
         print("ERROR:", e)
+        return False
     finally:
-        # Return to home position
-        print("Move to home:", HOME_POS)
+        monitor.stop()
+        write_status(done_job_id=job_id)
+        tracer.export_metrics()
+
+
+def go_home():
+    """Return to home position"""
+    print("Move to home:", HOME_POS)
+    with tracer.span("home"):
         arm.set_servo_angle(angle=HOME_POS, wait=True)
-        if GRIPPER_TYPE == 'vacuum':
-            arm.set_vacuum_gripper(on=False, wait=True,
-                                   timeout=3, hardware_version=2)
-        else:
-            arm.set_gripper_position(GRIPPER_OPEN_POS, wait=True)
-        write_status(
-            "OK", {"x": HOME_POS[0], "y": HOME_POS[1], "z": HOME_POS[2]})
+        open_gripper()
+    write_status(
+        "OK", {"x": HOME_POS[0], "y": HOME_POS[1], "z": HOME_POS[2]})
 
 
-write_status("BUSY", {"x": HOME_POS[0], "y": HOME_POS[1], "z": HOME_POS[2]})
-if GRIPPER_TYPE == 'vacuum':
-    arm.set_vacuum_gripper(on=False, wait=True, timeout=3, hardware_version=2)
-else:
-    arm.set_gripper_position(GRIPPER_OPEN_POS, wait=True)
-arm.set_servo_angle(angle=HOME_POS, wait=True)
-write_status("OK", {"x": HOME_POS[0], "y": HOME_POS[1], "z": HOME_POS[2]})
-while True:
+def add_command(command):
+    """Add the jobs of a command to the job queue"""
+    if command['type'] == 'pick_and_place':
+        jobs.append(command)
+    elif command['type'] == 'batch':
+        for i, job in enumerate(command['jobs']):
+            jobs.append(dict(job, job_id=f"{command['job_id']}-{i}"))
+    else:
+        print("Unknown command:", command)
+
+
+def collect_jobs(timeout):
+    """Move the received commands and the pick file to the job queue"""
+    command = server.receive(timeout=timeout)
+    while command is not None:
+        add_command(command)
+        command = server.receive(timeout=0)
+
     if os.path.exists(PICK_FILE):
         try:
             with open(PICK_FILE, 'r') as f:
                 pick_and_place_data = json.load(f)
-            print("Pick and place requested:", pick_and_place_data)
             # Remove the file
             os.remove(PICK_FILE)
-            # Execute pick and place
-            pick_and_place(pick_and_place_data)
-
+            pick_and_place_data.setdefault('type', 'pick_and_place')
+            pick_and_place_data.setdefault('job_id', new_job_id())
+            add_command(pick_and_place_data)
         except Exception as e:
             print("Error reading pick_and_place.json:", e)
-    time.sleep(SLEEP_TIME)
+
+
+write_status("BUSY", {"x": HOME_POS[0], "y": HOME_POS[1], "z": HOME_POS[2]})
+open_gripper()
+arm.set_servo_angle(angle=HOME_POS, wait=True)
+write_status("OK", {"x": HOME_POS[0], "y": HOME_POS[1], "z": HOME_POS[2]})
+server = CommandServer(COMMAND_HOST, COMMAND_PORT)
+chained = False
+while True:
+    # Block on the command channel only when there is nothing to do.
+    collect_jobs(timeout=0 if jobs else SLEEP_TIME)
+    if not jobs:
+        continue
+
+    job = jobs.popleft()
+    print(f"Pick and place requested (job {job['job_id']}, {len(jobs)} queued):", job)
+    done = pick_and_place(job, chained, final_wait=not jobs)
+
+    # Chain the next job from the place approach pose, go home only when
+    # the queue runs dry or after an error.
+    collect_jobs(timeout=0)
+    chained = done and len(jobs) > 0
+    if not chained:
+        go_home()